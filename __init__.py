@@ -4,16 +4,19 @@ from flask_cors import CORS
 from flask_jwt_extended.exceptions import NoAuthorizationError
 from flask_restx import Api
 from config import Config
-from utils.qrCode import generate_secure_token
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    config_class.init_app(app)
 
     # Initialize extensions
     from models import db
     db.init_app(app)
 
+    from utils.dbProfile import configure_database
+    configure_database(app)
+
     jwt = JWTManager(app)
     CORS(
         app,
@@ -43,10 +46,24 @@ def create_app(config_class=Config):
     from routes.log import log_ns
     api.add_namespace(log_ns, path='/log')
 
+    from routes.stream import sock
+    sock.init_app(app)
+
+    # Before the admin account below gets its password hash
+    from utils.passwordHasher import configure_password_hasher
+    configure_password_hasher(app)
+
     # Create database tables
     with app.app_context():
         db.create_all()
 
+        # Columns, indexes and data conversions create_all() cannot do
+        from utils.migrations import configure_migrations
+        configure_migrations(app)
+
+        from utils.qrCode import configure_qr, generate_secure_token
+        configure_qr(app)
+
         # Create default admin user if not exists
         from models import User
         ADMIN_EMAIL = app.config["ADMIN_EMAIL"]
@@ -58,9 +75,36 @@ def create_app(config_class=Config):
                 is_admin=True
             )
             admin.set_password(ADMIN_PASS)  # Change this in production!
-            admin.set_qr_token(generate_secure_token(admin.id))
             db.session.add(admin)
-            db.session.commit()
+            db.session.flush()
+            admin.set_qr_token(generate_secure_token(admin))
+
+        from utils.faceIndex import configure_face_index
+        configure_face_index(app)
+
+    from utils.faceRecognition import configure_face_model
+    configure_face_model(app)
+
+    from utils.identityCache import configure_identity_cache
+    configure_identity_cache(app)
+
+    from utils.inference import configure_inference
+    configure_inference(app)
+
+    from utils.logWriter import configure_log_writer
+    configure_log_writer(app)
+
+    from utils.accessJournal import configure_access_journal
+    configure_access_journal(app)
+
+    from utils.logArchive import configure_log_archive
+    configure_log_archive(app)
+
+    from utils.expirySweeper import configure_expiry_sweeper
+    configure_expiry_sweeper(app)
+
+    from utils.bulkEnroll import configure_enrollment_jobs
+    configure_enrollment_jobs(app)
 
     jwt.init_app(app)
 
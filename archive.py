@@ -0,0 +1,44 @@
+"""
+Move access logs older than N days into per-month archive tables.
+
+    python archive.py --days 180
+
+The server does the same every LOG_ARCHIVE_INTERVAL seconds when
+LOG_RETENTION_DAYS is set. Archived logs stay readable through /log and
+/log/export.
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from __init__ import create_app
+from config import DevelopmentConfig, ProductionConfig
+from utils.logArchive import archive_logs
+
+# Choose config based on environment
+config = ProductionConfig if os.environ.get('FLASK_ENV') == 'production' else DevelopmentConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Access log archival')
+    parser.add_argument('--days', type=int, default=None, help='archive logs older than this (default: LOG_RETENTION_DAYS)')
+    parser.add_argument('--batch-size', type=int, default=None, help='rows moved per transaction')
+    args = parser.parse_args()
+
+    app = create_app(config)
+    days = args.days or app.config.get('LOG_RETENTION_DAYS')
+    if not days:
+        parser.error('pass --days or set LOG_RETENTION_DAYS')
+
+    older_than = datetime.utcnow() - timedelta(days=days)
+    with app.app_context():
+        moved = archive_logs(
+            older_than,
+            batch_size=args.batch_size or app.config.get('LOG_ARCHIVE_BATCH_SIZE', 5000),
+            pause=app.config.get('LOG_ARCHIVE_PAUSE_MS', 50) / 1000.0,
+        )
+    print(f'archived {moved} logs older than {older_than:%Y-%m-%d %H:%M}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Recall / latency benchmark of the IVF face index against exact search.
+
+Run from the repository root:
+
+    python -m benchmarks.annRecall --gallery 100000 --nprobe 4 8 16 32
+
+Without --embeddings a synthetic gallery is used: random unit vectors as
+enrolled users and noisy copies of them as probes (a new photo of the
+same person). Pass an .npy file of real 512-d embeddings for numbers that
+reflect the actual distribution.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.annIndex import IVFIndex
+from utils.faceIndex import FaceIndex
+
+
+def make_gallery(size, dim, seed):
+    rng = np.random.default_rng(seed)
+    gallery = rng.standard_normal((size, dim)).astype(np.float32)
+    return gallery / np.linalg.norm(gallery, axis=1, keepdims=True)
+
+
+def make_probes(gallery, count, noise, seed):
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.choice(len(gallery), count, replace=False)
+    probes = gallery[picks] + noise * rng.standard_normal((count, gallery.shape[1])).astype(np.float32)
+    return probes / np.linalg.norm(probes, axis=1, keepdims=True)
+
+
+def run(index, probes, k):
+    latencies, results = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        matches = index.search(probe, k=k)
+        latencies.append(time.perf_counter() - start)
+        results.append([user_id for user_id, _ in matches])
+    return results, np.array(latencies) * 1000
+
+
+def recall(truth, found):
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / max(1, sum(len(t) for t in truth))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embeddings', help='.npy file with an (N, 512) embedding matrix')
+    parser.add_argument('--gallery', type=int, default=100000)
+    parser.add_argument('--probes', type=int, default=500)
+    parser.add_argument('--noise', type=float, default=0.04)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        gallery = np.load(args.embeddings).astype(np.float32)
+        gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    else:
+        gallery = make_gallery(args.gallery, 512, args.seed)
+    probes = make_probes(gallery, min(args.probes, len(gallery)), args.noise, args.seed)
+
+    exact = FaceIndex(dim=gallery.shape[1])
+    exact.load(enumerate(gallery))
+    truth, exact_ms = run(exact, probes, args.k)
+    print(f'gallery={len(gallery)} probes={len(probes)} k={args.k}')
+    print(f'{"index":<18}{"recall@1":>10}{"recall@k":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    print(f'{"exact":<18}{1.0:>10.3f}{1.0:>10.3f}'
+          f'{np.percentile(exact_ms, 50):>10.2f}{np.percentile(exact_ms, 99):>10.2f}')
+
+    ivf = FaceIndex(dim=gallery.shape[1], backend=IVFIndex(nlist=args.nlist))
+    start = time.perf_counter()
+    ivf.load(enumerate(gallery))
+    print(f'ivf build: nlist={ivf.backend.nlist or len(ivf.backend.centroids)} '
+          f'{time.perf_counter() - start:.1f}s')
+
+    for nprobe in args.nprobe:
+        ivf.backend.nprobe = nprobe
+        found, ivf_ms = run(ivf, probes, args.k)
+        top1 = recall([t[:1] for t in truth], [f[:1] for f in found])
+        print(f'{f"ivf nprobe={nprobe}":<18}{top1:>10.3f}{recall(truth, found):>10.3f}'
+              f'{np.percentile(ivf_ms, 50):>10.2f}{np.percentile(ivf_ms, 99):>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
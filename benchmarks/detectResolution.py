@@ -0,0 +1,72 @@
+"""
+Face detection latency vs. miss rate per detector input size.
+
+Run from the repository root against a folder of door-camera frames:
+
+    python -m benchmarks.detectResolution samples/ --sizes 160 320 480 640
+
+Each fixed size is measured on its own, followed by the adaptive ladder
+(smallest size first, larger ones only when nothing is found) as used by
+get_embedding(). A miss is a frame where no usable face was returned.
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils.faceRecognition import detect_face, face_model
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def load_images(folder):
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(EXTENSIONS):
+            image = cv2.imread(os.path.join(folder, name), cv2.IMREAD_COLOR)
+            if image is not None:
+                images.append(image)
+    return images
+
+
+def measure(images, det_sizes, repeat):
+    latencies, misses = [], 0
+    for image in images:
+        found = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            found = detect_face(image, det_sizes=det_sizes)
+            latencies.append(time.perf_counter() - start)
+        misses += found is None
+    return np.array(latencies) * 1000, misses / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder', help='directory with sample frames')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[160, 320, 480, 640])
+    parser.add_argument('--min-face-size', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    images = load_images(args.folder)
+    if not images:
+        parser.error(f'no images found in {args.folder}')
+
+    sizes = sorted(args.sizes)
+    face_model.configure(det_size=(sizes[-1], sizes[-1]), det_sizes=sizes, min_face_size=args.min_face_size)
+    face_model.warmup()
+
+    print(f'images={len(images)} repeat={args.repeat} min_face_size={args.min_face_size}')
+    print(f'{"det_size":<16}{"miss rate":>10}{"mean ms":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    runs = [(str(size), (size,)) for size in sizes] + [('adaptive ' + '/'.join(map(str, sizes)), sizes)]
+    for label, det_sizes in runs:
+        latencies, miss_rate = measure(images, det_sizes, args.repeat)
+        print(f'{label:<16}{miss_rate:>10.3f}{latencies.mean():>10.2f}'
+              f'{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 99):>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Offset vs keyset (cursor) pagination of the logs table.
+
+Run from the repository root:
+
+    python -m benchmarks.logPagination --rows 10000000 --db /tmp/logs-bench.db
+
+The database is filled with synthetic logs on the first run (that takes a
+few minutes for 10M rows) and reused afterwards. For a set of page depths
+it times the query LogList.get issues for ?page=N (OFFSET) and for the
+equivalent ?cursor=... (keyset on (created_at, id)), unfiltered and
+filtered by user or status plus a date range, and prints the query plan
+of the filtered keyset query.
+"""
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.schema import CreateTable
+
+from models import Log
+from utils.pagination import after
+
+EPOCH = datetime(2024, 1, 1)
+
+
+def populate(path, rows, users, seed, chunk=200000):
+    """Bulk-load synthetic logs with raw sqlite3; the indexes are built afterwards."""
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.execute(CreateTable(Log.__table__, if_not_exists=True))
+    engine.dispose()
+
+    rng = np.random.default_rng(seed)
+    span = 365 * 86400
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    for start in range(0, rows, chunk):
+        size = min(chunk, rows - start)
+        # Ids grow with time, like rows appended by the log writer
+        seconds = start * span // rows + np.sort(rng.integers(0, size * span // rows + 1, size))
+        conn.executemany(
+            'INSERT INTO logs (user_id, access_granted, error_log, method, created_at) VALUES (?, ?, ?, ?, ?)',
+            (
+                (int(user_id), bool(granted), None, int(method), str(EPOCH + timedelta(seconds=int(second))))
+                for user_id, granted, method, second in zip(
+                    rng.integers(1, users + 1, size), rng.random(size) < 0.8,
+                    rng.integers(1, 4, size), np.minimum(seconds, span - 1),
+                )
+            ),
+        )
+        conn.commit()
+        print(f'\rinserted {start + size}/{rows}', end='', flush=True)
+    print()
+    conn.close()
+
+
+def timed(conn, statement, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(statement).all()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='logs-bench.db')
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        start = time.perf_counter()
+        populate(args.db, args.rows, args.users, args.seed)
+        print(f'populated in {time.perf_counter() - start:.0f}s')
+
+    engine = create_engine(f'sqlite:///{args.db}')
+    with engine.begin() as conn:
+        start = time.perf_counter()
+        for index in Log.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
+        print(f'indexes ready in {time.perf_counter() - start:.0f}s')
+
+    order = (Log.created_at.desc(), Log.id.desc())
+    columns = (Log.id, Log.user_id, Log.access_granted, Log.error_log, Log.method, Log.created_at)
+    since = EPOCH + timedelta(days=30)
+    filters = {
+        'all': (),
+        'user+range': (Log.user_id == 42, Log.created_at >= since),
+        'denied+range': (Log.access_granted == False, Log.created_at >= since),  # noqa: E712
+    }
+
+    with engine.connect() as conn:
+        total = conn.execute(select(func.count()).select_from(Log)).scalar()
+        print(f'rows={total} per_page={args.per_page}')
+        print(f'{"filter":<14}{"page":>8}{"offset ms":>12}{"cursor ms":>12}')
+        for name, where in filters.items():
+            base = select(*columns).where(*where).order_by(*order)
+            for depth in args.depths:
+                offset = (depth - 1) * args.per_page
+                offset_query = base.offset(offset).limit(args.per_page + 1)
+
+                # The cursor a client would hold after reading the previous page
+                key = conn.execute(
+                    select(Log.created_at, Log.id).where(*where).order_by(*order).offset(max(offset - 1, 0)).limit(1)
+                ).first()
+                if key is None:
+                    break
+                cursor_query = base.where(after((Log.created_at, Log.id), tuple(key))).limit(args.per_page + 1) \
+                    if depth > 1 else base.limit(args.per_page + 1)
+
+                print(f'{name:<14}{depth:>8}{timed(conn, offset_query, args.repeat):>12.2f}'
+                      f'{timed(conn, cursor_query, args.repeat):>12.2f}')
+
+        plan_query = select(*columns).where(*filters['user+range']).order_by(*order).limit(args.per_page + 1)
+        compiled = plan_query.compile(engine, compile_kwargs={'literal_binds': True})
+        print('plan (user+range):')
+        for row in conn.execute(text(f'EXPLAIN QUERY PLAN {compiled}')):
+            print('  ', row[-1])
+
+
+if __name__ == '__main__':
+    main()
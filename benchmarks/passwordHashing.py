@@ -0,0 +1,104 @@
+"""
+Login throughput and latency per password hashing cost.
+
+Run from the repository root:
+
+    python -m benchmarks.passwordHashing --concurrency 32 --logins 400
+    python -m benchmarks.passwordHashing --scrypt-n 8192 16384 32768 --pbkdf2-iterations 300000 600000
+
+For every cost setting, ``--concurrency`` client threads verify a stored
+hash ``--logins`` times in total through PasswordHasher, the same bounded
+pool /auth/login uses. The report shows logins/sec, p50 and p99 latency
+(including time spent waiting for a pool worker) and how many logins
+were rejected with 503 because the pool was saturated. Logins/sec for
+one process times the number of worker processes estimates the capacity
+of a deployment; p99 should stay well below the client timeout.
+"""
+import argparse
+import queue
+import threading
+import time
+
+import numpy as np
+
+from utils.passwordHasher import PasswordHasher, hash_password
+
+PASSWORD = 'correct horse battery staple'
+
+
+def run(hasher, encoded, logins, concurrency):
+    latencies, rejected = [], 0
+    lock = threading.Lock()
+    remaining = iter(range(logins))
+
+    def client():
+        nonlocal rejected
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            try:
+                assert hasher.verify(PASSWORD, encoded)
+            except queue.Full:
+                with lock:
+                    rejected += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.asarray(latencies or [0.0])
+    return {
+        'logins_per_sec': (logins - rejected) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'rejected': rejected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scrypt-n', type=int, nargs='*', default=[2 ** 12, 2 ** 14, 2 ** 15])
+    parser.add_argument('--scrypt-r', type=int, default=8)
+    parser.add_argument('--pbkdf2-iterations', type=int, nargs='*', default=[100000, 600000])
+    parser.add_argument('--legacy', action='store_true', help='also measure the old unsalted SHA-256')
+    parser.add_argument('--workers', type=int, default=None, help='pool size, default: CPU count')
+    parser.add_argument('--queue', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=200)
+    args = parser.parse_args()
+
+    settings = [('scrypt', {'n': n, 'r': args.scrypt_r, 'p': 1}) for n in args.scrypt_n]
+    settings += [('pbkdf2_sha256', {'i': iterations}) for iterations in args.pbkdf2_iterations]
+
+    hasher = PasswordHasher(workers=args.workers, max_pending=args.queue, timeout=args.timeout)
+    print(f'workers={hasher.workers} concurrency={args.concurrency} logins={args.logins}')
+    print(f'{"hasher":<16}{"params":<22}{"logins/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"503s":>7}')
+
+    rows = []
+    if args.legacy:
+        from hashlib import sha256
+        rows.append(('sha256', '-', sha256(PASSWORD.encode()).hexdigest()))
+    for algorithm, params in settings:
+        hasher.configure(algorithm, params, args.workers, args.queue, args.timeout)
+        encoded = hash_password(PASSWORD, algorithm, params)
+        rows.append((algorithm, encoded.split('$')[1], encoded))
+
+    for algorithm, params, encoded in rows:
+        result = run(hasher, encoded, args.logins, args.concurrency)
+        print(f'{algorithm:<16}{params:<22}{result["logins_per_sec"]:>10.1f}'
+              f'{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}{result["rejected"]:>7}')
+    hasher.stop()
+
+
+if __name__ == '__main__':
+    main()
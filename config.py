@@ -13,6 +13,21 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False
 
+    # Migrations (utils/migrations.py, migrate.py): schema ones always run at startup
+    MIGRATE_DATA_ON_STARTUP = True  # False: leave batched data migrations to `python migrate.py up`
+    MIGRATION_BATCH_SIZE = 1000  # rows per transaction
+    MIGRATION_PAUSE_MS = 20  # pause between batches, lets door events take the write lock
+
+    # SQLite tuning, run on every new connection (utils/dbProfile.py); {} keeps SQLite's defaults
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',  # readers no longer block the writer and vice versa
+        'synchronous': 'NORMAL',  # fsync at checkpoints instead of every commit; durable with WAL
+        'busy_timeout': 5000,  # ms to wait for the write lock before "database is locked"
+        'mmap_size': 256 * 1024 * 1024,  # read pages through the OS page cache
+        'cache_size': -64000,  # negative: KiB, so about 64 MB of page cache per connection
+        'temp_store': 'MEMORY',
+    }
+
     # JWT
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'haslo'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
@@ -22,9 +37,101 @@ class Config:
     JWT_COOKIE_SAMESITE = "None"
     JWT_COOKIE_CSRF_PROTECT = False
 
+    # QR tokens
+    QR_SECRET_KEY = os.environ.get('QR_SECRET_KEY') or SECRET_KEY
+    QR_SIGNATURE_LENGTH = 16
+    QR_ACCEPT_LEGACY = True  # old "<id>|<sig>" tokens, checked against the database
+    QR_REVOCATION_REFRESH = 30  # seconds between reloads of revocations made by other workers
+
+    # Access log writer: rows are batched by a background thread
+    LOG_WRITER_SYNC = False  # True: commit every row on the request thread
+    LOG_WRITER_MAX_BATCH = 500
+    LOG_WRITER_FLUSH_MS = 200
+    LOG_WRITER_QUEUE_SIZE = 10000
+    LOG_WRITER_OVERFLOW = 'block'  # 'block', 'sync' or 'drop' when the queue is full
+    LOG_WRITER_BLOCK_TIMEOUT = 1.0  # seconds before 'block' falls back to a sync write
+
+    # Access journal: door events are appended to a memory-mapped file and
+    # compacted into the logs table in bulk
+    LOG_JOURNAL = True
+    LOG_JOURNAL_PATH = None  # default: next to the SQLite file, else the instance folder
+    LOG_JOURNAL_SEGMENT_RECORDS = 65536  # 16 bytes per record
+    LOG_JOURNAL_COMPACT_MS = 1000
+
+    # Log retention: logs older than this many days move to monthly archive tables
+    LOG_RETENTION_DAYS = None  # None keeps everything in the logs table
+    LOG_ARCHIVE_INTERVAL = 3600  # seconds between archiving runs
+    LOG_ARCHIVE_BATCH_SIZE = 5000  # rows moved per transaction
+    LOG_ARCHIVE_PAUSE_MS = 50  # pause between batches, lets door events take the write lock
+
+    # Rows fetched per server-side cursor batch by /log/export and export.py
+    LOG_EXPORT_BATCH_SIZE = 5000
+
+    # Users resolved from JWT identities are cached per worker for this long
+    IDENTITY_CACHE_TTL = 30  # seconds
+    IDENTITY_CACHE_SIZE = 10000
+
+    # Expired users: QR tokens revoked and 1:N face matches refused, checked this often
+    USER_EXPIRY_SWEEP_INTERVAL = 60  # seconds, 0 disables the sweeper
+    USER_EXPIRY_SWEEP_BATCH = 1000  # users revoked per transaction
+
+    # Users per request of /users/bulk
+    USER_BULK_MAX = 1000
+
+    # Password hashing: the KDF and cost of new hashes; older hashes are upgraded on login
+    PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER') or 'scrypt'  # 'scrypt' or 'pbkdf2_sha256'
+    PASSWORD_SCRYPT_N = 2 ** 14
+    PASSWORD_SCRYPT_R = 8
+    PASSWORD_SCRYPT_P = 1
+    PASSWORD_PBKDF2_ITERATIONS = 600000
+    PASSWORD_HASH_WORKERS = None  # concurrent KDF computations, default: CPU count
+    PASSWORD_HASH_QUEUE = 64  # logins waiting for a worker before 503
+    PASSWORD_HASH_TIMEOUT = 5  # seconds a login waits for a slot
+
     # CORS
     CORS_HEADERS = 'Content-Type'
 
+    @staticmethod
+    def init_app(app):
+        pass
+
+    # Face recognition model (loaded lazily on first use)
+    FACE_MODEL_NAME = os.environ.get('FACE_MODEL_NAME') or 'buffalo_l'
+    FACE_DET_SIZE = (640, 640)
+    FACE_DET_SIZES = (320, 640)  # tried smallest first, larger only when no face is found
+    FACE_MIN_FACE_SIZE = 40  # pixels; smaller faces are rejected before recognition
+    FACE_MIN_DET_SCORE = 0.5
+    FACE_MODEL_MODULES = ('detection', 'recognition')  # skip landmarks and genderage
+    FACE_MODEL_CTX_ID = 0
+    FACE_MODEL_WARMUP = os.environ.get('FACE_MODEL_WARMUP', '').lower() in ('1', 'true', 'yes')
+
+    # Face inference worker: frames are micro-batched into one recognition call
+    FACE_BATCH_MAX_SIZE = 16
+    FACE_BATCH_MAX_WAIT_MS = 5
+    FACE_QUEUE_SIZE = 256
+    FACE_INFERENCE_TIMEOUT = 10  # seconds
+
+    FACE_MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+    FACE_EMBEDDING_FORMAT = os.environ.get('FACE_EMBEDDING_FORMAT') or 'float32'  # float32, float16 or int8
+    FACE_MAX_TEMPLATES = 5  # oldest templates beyond this are dropped on enrollment
+    FACE_TEMPLATE_MATCH = 'max'  # 'max', 'mean' or 'centroid' (one row per user in the index)
+
+    # Bulk enrollment (/users/photos/bulk and enroll.py)
+    FACE_BULK_WORKERS = None  # decoder processes, default: CPU count
+    FACE_BULK_BATCH_SIZE = 64  # aligned crops per recognition call
+    FACE_BULK_QUEUE = 4  # archives waiting for the background job; more get 503
+
+    # Face verification stream (/auth/face/stream)
+    FACE_STREAM_MAX_FAILURES = 5  # processed frames before the attempt is rejected
+    FACE_STREAM_DUPLICATE_THRESHOLD = 4.0  # mean abs diff of 32x32 gray thumbnails
+
+    # Face identification index ('exact' or 'ivf')
+    FACE_INDEX_BACKEND = os.environ.get('FACE_INDEX_BACKEND') or 'exact'
+    FACE_INDEX_PATH = os.environ.get('FACE_INDEX_PATH')  # default: next to the database
+    FACE_INDEX_NLIST = None  # default: 4 * sqrt(gallery size)
+    FACE_INDEX_NPROBE = 32
+    FACE_INDEX_REBUILD_THRESHOLD = 1024
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -35,14 +142,34 @@ class ProductionConfig(Config):
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
-    # Ensure secret keys are set in production
-    if not os.environ.get('SECRET_KEY'):
-        raise ValueError("SECRET_KEY environment variable must be set in production")
-    if not os.environ.get('JWT_SECRET_KEY'):
-        raise ValueError("JWT_SECRET_KEY environment variable must be set in production")
+    # Connection pool per worker process, for a server database such as PostgreSQL
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 10),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 10),
+        'pool_timeout': 10,  # seconds to wait for a free connection
+        'pool_recycle': 1800,  # reconnect before server or proxy idle timeouts
+        'pool_pre_ping': True,  # replace connections dropped by a database restart
+        'query_cache_size': 1000,  # compiled statements kept per engine
+    }
+    if (SQLALCHEMY_DATABASE_URI or '').startswith('postgresql+psycopg://'):
+        # psycopg 3: use server-side prepared statements for queries run 5+ times
+        SQLALCHEMY_ENGINE_OPTIONS['connect_args'] = {'prepare_threshold': 5}
+
+    @staticmethod
+    def init_app(app):
+        # Checked when the app is created, so importing config never fails
+        if not os.environ.get('SECRET_KEY'):
+            raise ValueError("SECRET_KEY environment variable must be set in production")
+        if not os.environ.get('JWT_SECRET_KEY'):
+            raise ValueError("JWT_SECRET_KEY environment variable must be set in production")
 
 
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=5)
\ No newline at end of file
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=5)
+    QR_REVOCATION_REFRESH = 0
+    LOG_WRITER_SYNC = True
+    LOG_JOURNAL = False
+    PASSWORD_SCRYPT_N = 2 ** 10
+    USER_EXPIRY_SWEEP_INTERVAL = 0
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""
+Bulk-enroll face photos named <email>.jpg from a directory or zip archive.
+
+    python enroll.py photos.zip --workers 8 --report enroll_report.json
+"""
+import argparse
+import json
+import os
+
+from __init__ import create_app
+from config import DevelopmentConfig, ProductionConfig
+from utils.bulkEnroll import enroll_photos
+from utils.embeddingCodec import format_code
+
+# Choose config based on environment
+config = ProductionConfig if os.environ.get('FLASK_ENV') == 'production' else DevelopmentConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk face enrollment')
+    parser.add_argument('source', help='directory or zip archive with <email>.jpg files')
+    parser.add_argument('--workers', type=int, default=None, help='decoder processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=None, help='aligned crops per recognition call')
+    parser.add_argument('--report', help='write the per-file results to this JSON file')
+    args = parser.parse_args()
+
+    app = create_app(config)
+    with app.app_context():
+        report = enroll_photos(
+            args.source,
+            workers=args.workers or app.config.get('FACE_BULK_WORKERS'),
+            batch_size=args.batch_size or app.config.get('FACE_BULK_BATCH_SIZE', 64),
+            fmt=format_code(app.config.get('FACE_EMBEDDING_FORMAT', 'float32')),
+            max_templates=app.config.get('FACE_MAX_TEMPLATES', 5),
+        )
+
+    print(f"{report['enrolled']}/{report['total']} enrolled, {report['failed']} failed")
+    for reason, count in sorted(report['failures'].items()):
+        print(f'  {reason}: {count}')
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
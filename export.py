@@ -0,0 +1,60 @@
+"""
+Export door events, joined with the user email, as CSV, NDJSON or Parquet.
+
+    python export.py --month 2025-01 --format csv --output logs-2025-01.csv
+    python export.py --since 2025-01-01 --until 2025-04-01 --format parquet --output q1.parquet
+
+Rows are streamed with a server-side cursor, so memory stays flat for any
+number of rows. Parquet needs the optional pyarrow package.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+from __init__ import create_app
+from config import DevelopmentConfig, ProductionConfig
+from utils.logArchive import month_range
+from utils.logExport import export_logs, parquet_available, FORMATS
+
+# Choose config based on environment
+config = ProductionConfig if os.environ.get('FLASK_ENV') == 'production' else DevelopmentConfig
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Access log export')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--month', help='export one month (YYYY-MM)')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='start date (ISO format)')
+    parser.add_argument('--until', type=datetime.fromisoformat, help='end date, exclusive (ISO format)')
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--batch-size', type=int, default=None, help='rows per cursor batch')
+    parser.add_argument('--output', help='output file (default: stdout)')
+    args = parser.parse_args()
+
+    if args.format == 'parquet' and not parquet_available():
+        parser.error('parquet export needs the pyarrow package')
+    start, end = month_range(args.month) if args.month else (args.since, args.until)
+
+    app = create_app(config)
+    binary = args.format == 'parquet'
+    if args.output:
+        out = open(args.output, 'wb' if binary else 'w', newline='' if not binary else None)
+    else:
+        out = sys.stdout.buffer if binary else sys.stdout
+
+    with app.app_context():
+        chunks = export_logs(
+            args.format,
+            batch_size=args.batch_size or app.config.get('LOG_EXPORT_BATCH_SIZE', 5000),
+            start=start, end=end, user_id=args.user_id,
+        )
+        for chunk in chunks:
+            out.write(chunk)
+    if args.output:
+        out.close()
+        print(f'wrote {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
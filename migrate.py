@@ -0,0 +1,60 @@
+"""
+Show or apply database migrations (utils/migrations.py).
+
+    python migrate.py status
+    python migrate.py up --batch-size 5000 --pause-ms 50
+    python migrate.py up --only 0008_log_rollups
+
+The server applies schema migrations at startup, and data migrations too
+unless MIGRATE_DATA_ON_STARTUP is off. Data migrations run in short
+batches with a pause in between, so they can run here while the doors
+keep working; an interrupted run resumes from its last batch.
+"""
+import argparse
+import logging
+import os
+
+from __init__ import create_app
+from config import DevelopmentConfig, ProductionConfig
+from utils.migrations import migration_status, run_migrations
+
+# Choose config based on environment
+base = ProductionConfig if os.environ.get('FLASK_ENV') == 'production' else DevelopmentConfig
+
+
+class config(base):
+    # Data migrations are run below, with the command line's batch size and pause
+    MIGRATE_DATA_ON_STARTUP = False
+    SQLALCHEMY_ECHO = False
+
+
+def print_status():
+    print(f'{"migration":<28}{"kind":<8}{"state":<9}{"rows":>10}{"batches":>9}{"seconds":>10}  finished')
+    for item in migration_status():
+        print(f'{item["id"]:<28}{item["kind"]:<8}{item["state"]:<9}{item["rows"]:>10}{item["batches"]:>9}'
+              f'{item["duration_ms"] / 1000:>10.1f}  {item["finished_at"] or "-"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Database migrations')
+    parser.add_argument('command', choices=['status', 'up'])
+    parser.add_argument('--only', nargs='+', default=None, help='migration ids to apply')
+    parser.add_argument('--batch-size', type=int, default=None, help='rows per transaction')
+    parser.add_argument('--pause-ms', type=int, default=None, help='pause between batches')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    app = create_app(config)
+    with app.app_context():
+        if args.command == 'up':
+            applied = run_migrations(
+                only=args.only,
+                batch_size=args.batch_size or app.config.get('MIGRATION_BATCH_SIZE', 1000),
+                pause=(args.pause_ms if args.pause_ms is not None else app.config.get('MIGRATION_PAUSE_MS', 20)) / 1000.0,
+            )
+            print(f'applied {len(applied)} migrations')
+        print_status()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,51 @@
+import json
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 import hashlib
 
-from sqlalchemy import JSON
+import numpy as np
+from sqlalchemy import JSON, select
+from sqlalchemy.orm import selectinload
+
+from utils.embeddingCodec import encode, decode, centroid, FORMAT_FLOAT32
+from utils.logCodes import method_name, METHOD_UNKNOWN
+from utils.passwordHasher import password_hasher
 
 db = SQLAlchemy()
 
 
 class User(db.Model):
     __tablename__ = 'users'
+    # Ids of deleted users are never handed out again (their QR revocations stay)
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(256), nullable=False)
-    biometric_hash = db.Column(JSON, nullable=True)
+    biometric_hash = db.Column(JSON, nullable=True)  # legacy JSON list, converted by utils/migrations.py
+    biometric_blob = db.Column(db.LargeBinary, nullable=True)
+    biometric_format = db.Column(db.SmallInteger, nullable=True)  # utils/embeddingCodec.py FORMAT_*
     qr_token = db.Column(db.String(256), nullable=True)
-    expire_time = db.Column(db.DateTime, default=datetime.now())
+    token_version = db.Column(db.Integer, default=0, nullable=True)  # bumped to revoke issued QR tokens
+    expire_time = db.Column(db.DateTime, default=datetime.now(), index=True)
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now(), nullable=False)
 
     # Relationship
     logs = db.relationship('Log', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    templates = db.relationship('FaceTemplate', backref='user', lazy='dynamic', cascade='all, delete-orphan')
 
     def set_password(self, password):
-        """Hash password using SHA-256"""
-        self.password_hash = hashlib.sha256(password.encode()).hexdigest()
+        """Hash password with the configured KDF (utils/passwordHasher.py)"""
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        """Verify password against hash"""
-        return self.password_hash == hashlib.sha256(password.encode()).hexdigest()
+        """Verify password against hash; legacy SHA-256 hashes are still accepted"""
+        return password_hasher.verify(password, self.password_hash)
+
+    def password_needs_upgrade(self):
+        """True when the stored hash is legacy SHA-256 or uses other KDF parameters"""
+        return password_hasher.needs_rehash(self.password_hash)
 
     def set_biometric(self, biometric_data):
         """Hash biometric data using SHA-256"""
@@ -45,6 +62,45 @@ class User(db.Model):
         else:
             return self.biometric_hash == hashlib.sha256(biometric_data).hexdigest()
 
+    def set_embedding(self, embedding, fmt=FORMAT_FLOAT32):
+        """Store a face embedding as a compact binary vector"""
+        self.biometric_blob = encode(embedding, fmt)
+        self.biometric_format = fmt
+        self.biometric_hash = None
+
+    def add_template(self, embedding, fmt=FORMAT_FLOAT32, max_templates=5):
+        """
+        Enroll one more face template, dropping the oldest ones beyond the cap.
+
+        The normalized centroid of the kept templates is stored in
+        biometric_blob. Returns the kept templates as one float32 matrix.
+        """
+        self.templates.append(FaceTemplate(embedding=encode(embedding, fmt), embedding_format=fmt))
+        db.session.flush()
+
+        templates = self.templates.order_by(FaceTemplate.id.desc()).all()
+        for stale in templates[max_templates:]:
+            db.session.delete(stale)
+        matrix = np.stack([template.get_embedding() for template in templates[:max_templates]])
+        self.set_embedding(centroid(matrix), fmt)
+        return matrix
+
+    def get_templates(self):
+        """Return all enrolled templates as an (n, 512) float32 matrix"""
+        rows = self.templates.with_entities(FaceTemplate.embedding_format, FaceTemplate.embedding).all()
+        if not rows:
+            embedding = self.get_embedding()
+            return embedding[None, :] if embedding is not None else np.empty((0, 512), dtype=np.float32)
+        return np.stack([decode(blob, fmt) for fmt, blob in rows])
+
+    def get_embedding(self):
+        """Return the stored face embedding as a float32 array, or None"""
+        if self.biometric_blob is not None:
+            return decode(self.biometric_blob, self.biometric_format)
+        if isinstance(self.biometric_hash, list):
+            return np.asarray(self.biometric_hash, dtype=np.float32)
+        return None
+
     def is_expired(self):
         """Check if user account is expired"""
         if self.expire_time:
@@ -72,31 +128,215 @@ class User(db.Model):
             'qr_token': self.qr_token,
         }
         if include_sensitive:
-            data['biometric_hash'] = self.biometric_hash
+            embedding = self.get_embedding()
+            data['biometric_hash'] = embedding.tolist() if embedding is not None else None
         return data
 
+    @classmethod
+    def listing_columns(cls):
+        """Fields GET /users can return (its ``fields=`` projection), as column expressions"""
+        return {
+            'id': cls.id,
+            'email': cls.email,
+            'is_admin': cls.is_admin,
+            'expire_time': cls.expire_time,
+            'created_at': cls.created_at,
+            'qr_token': cls.qr_token,
+            'has_biometric': cls.has_biometric_clause().label('has_biometric'),
+        }
+
+    @classmethod
+    def has_biometric_clause(cls):
+        # Legacy JSON embeddings are moved into biometric_blob at startup
+        return cls.biometric_blob.isnot(None)
+
+    @classmethod
+    def listing(cls, fields):
+        """Select of only ``fields`` (keys of listing_columns()), for row_to_dict"""
+        columns = cls.listing_columns()
+        return select(*(columns[name] for name in fields))
+
+    @staticmethod
+    def row_to_dict(row):
+        """Same values as to_dict() for a row of User.listing()"""
+        return {name: value.isoformat() if isinstance(value, datetime) else value
+                for name, value in row._mapping.items()}
+
     def __repr__(self):
         return f'<User {self.email}>'
 
 
+class FaceTemplate(db.Model):
+    __tablename__ = 'face_templates'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    embedding = db.Column(db.LargeBinary, nullable=False)
+    embedding_format = db.Column(db.SmallInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def get_embedding(self):
+        return decode(self.embedding, self.embedding_format)
+
+    def __repr__(self):
+        return f'<FaceTemplate {self.id} - User {self.user_id}>'
+
+
+class QRRevocation(db.Model):
+    __tablename__ = 'qr_revocations'
+
+    # No foreign key: deleted users keep their entry so their tokens stay revoked
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    min_version = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<QRRevocation User {self.user_id} - v{self.min_version}>'
+
+
+class JournalCheckpoint(db.Model):
+    __tablename__ = 'journal_checkpoints'
+
+    # Number of records of an access journal segment already loaded into logs
+    segment = db.Column(db.String(64), primary_key=True)
+    compacted = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<JournalCheckpoint {self.segment} - {self.compacted}>'
+
+
+class LogRollup(db.Model):
+    __tablename__ = 'log_rollups'
+
+    # Access counters per hour or day, maintained by utils/logRollup.py
+    period = db.Column(db.String(4), primary_key=True)  # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, primary_key=True)  # bucket start (UTC)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    grants = db.Column(db.Integer, nullable=False, default=0)
+    denials = db.Column(db.Integer, nullable=False, default=0)
+    unknown_attempts = db.Column(db.Integer, nullable=False, default=0)
+    qr_attempts = db.Column(db.Integer, nullable=False, default=0)
+    face_attempts = db.Column(db.Integer, nullable=False, default=0)
+    face_stream_attempts = db.Column(db.Integer, nullable=False, default=0)
+    user_ids = db.Column(db.LargeBinary, nullable=True)  # sorted distinct user ids, int32
+
+    def __repr__(self):
+        return f'<LogRollup {self.period} {self.bucket} - {self.attempts}>'
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migrations'
+
+    # One row per migration of utils/migrations.py that was started
+    id = db.Column(db.String(64), primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)  # last progress; stale unfinished rows are taken over
+    finished_at = db.Column(db.DateTime, nullable=True)
+    duration_ms = db.Column(db.Integer, nullable=False, default=0)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    batches = db.Column(db.Integer, nullable=False, default=0)
+    checkpoint = db.Column(db.Text, nullable=True)  # JSON, where a data migration resumes
+    skipped = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f'<SchemaMigration {self.id} - {"done" if self.finished_at else "running"}>'
+
+
+class EnrollmentJob(db.Model):
+    __tablename__ = 'enrollment_jobs'
+
+    # One row per archive queued on POST /users/photos/bulk, run by utils/bulkEnroll.py
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done, failed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    report = db.Column(db.Text, nullable=True)  # JSON report of enroll_photos()
+    error = db.Column(db.Text, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'report': json.loads(self.report) if self.report else None,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return f'<EnrollmentJob {self.id} - {self.status}>'
+
+
+class LogArchive(db.Model):
+    __tablename__ = 'log_archives'
+
+    # One row per month moved out of logs by utils/logArchive.py
+    month = db.Column(db.String(7), primary_key=True)  # 'YYYY-MM'
+    table_name = db.Column(db.String(32), nullable=False, unique=True)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<LogArchive {self.month} - {self.row_count} rows>'
+
+
 class Log(db.Model):
     __tablename__ = 'logs'
+    __table_args__ = (
+        # Filter + date range + (created_at, id) order are one index range scan
+        db.Index('ix_logs_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_logs_access_granted_created_at', 'access_granted', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     access_granted = db.Column(db.Boolean, nullable=False)
     error_log = db.Column(db.String(500), nullable=True)
+    method = db.Column(db.SmallInteger, default=METHOD_UNKNOWN, nullable=True)  # utils/logCodes.py METHOD_*
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=True, index=True)
 
     def to_dict(self):
-        """Convert log to dictionary"""
+        """Convert log to dictionary (load many with Log.eager_user() to avoid a query per row)"""
         return {
             'id': self.id,
             'user_id': self.user_id,
             'user_email': self.user.email if self.user else None,
             'access_granted': self.access_granted,
             'error_log': self.error_log,
-            'created_at': self.created_at.isoformat(),
+            'method': method_name(self.method),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+    @staticmethod
+    def eager_user():
+        """Loader option fetching the users' emails, and nothing else, in one extra query"""
+        return selectinload(Log.user).load_only(User.email)
+
+    @classmethod
+    def listing(cls, table=None):
+        """
+        Read-only select of plain row tuples with the user email joined in,
+        for row_to_dict. ``table`` may be a monthly archive table instead of logs.
+        """
+        table = cls.__table__ if table is None else table
+        return select(
+            table.c.id, table.c.user_id, User.email.label('user_email'), table.c.access_granted,
+            table.c.error_log, table.c.method, table.c.created_at,
+        ).outerjoin(User, User.id == table.c.user_id)
+
+    @staticmethod
+    def row_to_dict(row):
+        """Same output as to_dict() for a row of Log.listing(), without building ORM objects"""
+        return {
+            'id': row.id,
+            'user_id': row.user_id,
+            'user_email': row.user_email,
+            'access_granted': row.access_granted,
+            'error_log': row.error_log,
+            'method': method_name(row.method),
+            'created_at': row.created_at.isoformat() if row.created_at else None,
         }
 
     def __repr__(self):
@@ -1,25 +1,30 @@
-import base64
+import queue
 from datetime import datetime, timedelta
 
-import cv2
-import numpy as np
-
 from routes.log import make_log
 
-from flask import request, jsonify
+from flask import current_app, request, jsonify
 from flask_restx import Namespace, Resource, fields
 from flask_jwt_extended import (
     create_access_token,
     set_access_cookies,
     unset_jwt_cookies,
     jwt_required,
-    get_jwt_identity
+    get_jwt_identity,
+    get_jwt
 )
 
 from models import User, db
 from routes.user import admin_required
-from utils.faceRecognition import authenticate
-from utils.qrCode import verify_token, generate_secure_token
+from utils.expirySweeper import expired_users
+from utils.faceIndex import face_index
+from utils.identityCache import load_identity, load_identity_by_id
+from utils.faceRecognition import match_templates, MATCH_THRESHOLD
+from utils.imageUpload import read_request_image
+from utils.inference import inference_service, InferenceError, InferenceTimeout
+from utils.logCodes import METHOD_QR, METHOD_FACE
+from utils.passwordHasher import password_hasher
+from utils.qrCode import first_token_versions, verify_token, rotate_qr_token
 
 # Namespace
 auth_ns = Namespace('auth', description='Authentication operations')
@@ -85,9 +90,14 @@ class Signup(Resource):
             return {'message': 'Invalid day format'}, 400
 
         user = User(email=email, expire_time=expire_time)
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except queue.Full:
+            return {'message': 'Server busy, try again'}, 503
 
         db.session.add(user)
+        db.session.flush()
+        user.token_version = first_token_versions([user.id]).get(user.id, 0)
         db.session.commit()
         return {'message': 'User created successfully'}, 201
 
@@ -99,6 +109,7 @@ class Login(Resource):
     @auth_ns.response(400, 'Email and password required')
     @auth_ns.response(401, 'Invalid credentials')
     @auth_ns.response(403, 'Account expired')
+    @auth_ns.response(503, 'Server busy')
     def post(self):
         data = request.json
         email = data.get('email')
@@ -108,13 +119,29 @@ class Login(Resource):
             return {'message': 'Email and password required'}, 400
 
         user = User.query.filter_by(email=email).first()
-        if not user or not user.check_password(password):
+        try:
+            valid = user.check_password(password) if user else password_hasher.verify(password, None)
+        except queue.Full:
+            return {'message': 'Server busy, try again'}, 503
+        if not valid:
             return {'message': 'Invalid credentials'}, 401
 
+        # Rehash legacy SHA-256 or outdated KDF hashes while the password is at hand
+        if user.password_needs_upgrade():
+            try:
+                user.set_password(password)
+                db.session.commit()
+            except queue.Full:
+                pass  # try again on the next login
+
         if user.is_expired() and not user.is_admin:
             return {'message': 'Account expired'}, 403
 
-        access_token = create_access_token(identity=user.email)
+        # Id and admin flag ride along so routes don't have to look them up
+        access_token = create_access_token(
+            identity=user.email,
+            additional_claims={'uid': user.id, 'is_admin': user.is_admin},
+        )
 
         resp = jsonify({'message': 'Login successful'})
         set_access_cookies(resp, access_token)
@@ -139,9 +166,11 @@ class Me(Resource):
     @auth_ns.response(200, 'Success', user_model)
     @auth_ns.response(404, 'User not found')
     def get(self):
-        user_email = get_jwt_identity()
-        user = User.query.filter_by(email=user_email).first()
-        user = User.query.get(user.id)
+        user_id = get_jwt().get('uid')
+        if user_id is None:  # token issued before the uid claim existed
+            identity = load_identity(get_jwt_identity())
+            user_id = identity.id if identity else None
+        user = db.session.get(User, user_id) if user_id is not None else None
 
         if not user:
             return {'message': 'User not found'}, 404
@@ -163,8 +192,8 @@ class GenerateQR(Resource):
         if not user:
             return {'message': 'User not found'}, 404
 
-        token = generate_secure_token(user_id)
-        resp = user.set_qr_token(token)
+        # A new token revokes the previously issued one
+        resp = user.set_qr_token(rotate_qr_token(user))
 
         return resp
 
@@ -180,44 +209,93 @@ class VerifyQR(Resource):
         if not token:
             return {'message': 'Token is required'}, 400
 
+        # Signature, expiry and revocation are all checked without the database
         user_id = verify_token(token)
         if not user_id:
-            make_log(-1, False, "Invalid or expired QR token")
+            make_log(-1, False, "Invalid or expired QR token", METHOD_QR)
             return {'message': 'Invalid or expired QR token'}, 401
 
-        user = User.query.get(user_id)
-        if not user:
+        # The email comes from the identity cache, so a scan rarely touches users
+        identity = load_identity_by_id(user_id)
+        if not identity:
             return {'message': 'User not found'}, 404
 
-        make_log(user_id, True, "QR authentication successful")
+        make_log(user_id, True, "QR authentication successful", METHOD_QR)
 
         return {
             'message': 'QR authentication successful',
-            'user': user.email
+            'user': identity.email,
+            'user_id': user_id
         }, 200
 @auth_ns.route('/face/verify')
 class FaceVerify(Resource):
+    @auth_ns.doc(description='Verify a face. Send JSON {"image": data URL, "email": optional}, '
+                             'a raw image/jpeg or application/octet-stream body (email in ?email=), '
+                             'or a decoded BGR/GRAY frame with X-Frame-Width/X-Frame-Height headers.')
     def post(self):
-        data = request.json
-        img_base64 = data.get('image')
-        user_email = data.get('email')  # frontend wysyła email
-
-        if not img_base64 or not user_email:
-            return {'success': False, 'msg': 'Brak danych'}, 400
+        data = request.get_json(silent=True) or {}
+        user_email = data.get('email') or request.args.get('email')  # opcjonalny: bez emaila identyfikacja 1:N
 
-        # pobierz użytkownika z bazy
-        user = User.query.filter_by(email=user_email).first()
-        if not user:
-            make_log(-1, False, "Face not recognized")
-            return {'success': False, 'msg': 'Nie znaleziono użytkownika'}, 404
+        # pobierz użytkownika z bazy (tylko weryfikacja 1:1)
+        user = None
+        if user_email:
+            user = User.query.filter_by(email=user_email).first()
+            if not user:
+                make_log(-1, False, "Face not recognized", METHOD_FACE)
+                return {'success': False, 'msg': 'Nie znaleziono użytkownika'}, 404
 
         # dekodowanie obrazu
-        img_data = base64.b64decode(img_base64.split(',')[1])
-        nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        success, similarity = authenticate(img, user.biometric_hash)
-        match = True if similarity > 0.42 else False
-        if match: make_log(user.id, True, "access granted")
-        else: make_log(user.id, False, "face not recognized")
-        return {'success': match, 'similarity': float(similarity)}, 200
\ No newline at end of file
+        img, error = read_request_image('image', max_bytes=current_app.config.get('FACE_MAX_UPLOAD_BYTES'))
+        if img is None:
+            return {'success': False, 'msg': error}, 400
+
+        try:
+            embedding = inference_service.embed(img)
+        except (queue.Full, InferenceTimeout):
+            return {'success': False, 'msg': 'Serwer zajęty, spróbuj ponownie'}, 503
+        except InferenceError:
+            current_app.logger.exception('Face embedding failed')
+            return {'success': False, 'msg': 'Błąd rozpoznawania twarzy'}, 500
+
+        if user is None:
+            return identify_face(embedding)
+
+        if user.is_expired() and not user.is_admin:
+            make_log(user.id, False, "Account expired", METHOD_FACE)
+            return {'success': False, 'msg': 'Konto wygasło'}, 200
+
+        mode = current_app.config.get('FACE_TEMPLATE_MATCH', 'max')
+        score = match_templates(embedding, user.get_templates(), mode)
+        match = True if score > MATCH_THRESHOLD else False
+        if match: make_log(user.id, True, "access granted", METHOD_FACE)
+        else: make_log(user.id, False, "face not recognized", METHOD_FACE)
+        return {'success': match, 'similarity': float(score)}, 200
+
+
+@auth_ns.route('/face/stats')
+class FaceStats(Resource):
+    @admin_required()
+    @auth_ns.response(200, 'Inference queue depth, batch sizes and per-stage latency')
+    def get(self):
+        return inference_service.report(), 200
+
+
+def identify_face(embedding):
+    """Match an embedding against every enrolled user using the in-memory index."""
+    if embedding is None:
+        make_log(-1, False, "No face detected", METHOD_FACE)
+        return {'success': False, 'msg': 'Nie wykryto twarzy'}, 200
+
+    matches = face_index.search(embedding, k=1, aggregate=current_app.config.get('FACE_TEMPLATE_MATCH', 'max'))
+    if not matches or matches[0][1] <= MATCH_THRESHOLD:
+        make_log(-1, False, "Face not recognized", METHOD_FACE)
+        similarity = matches[0][1] if matches else 0.0
+        return {'success': False, 'similarity': similarity}, 200
+
+    user_id, similarity = matches[0]
+    if user_id in expired_users:
+        make_log(user_id, False, "Account expired", METHOD_FACE)
+        return {'success': False, 'msg': 'Konto wygasło', 'similarity': similarity}, 200
+
+    make_log(user_id, True, "access granted", METHOD_FACE)
+    return {'success': True, 'similarity': similarity, 'user_id': user_id}, 200
@@ -1,29 +1,36 @@
-from flask import request
+from flask import current_app, request, Response, stream_with_context
+from sqlalchemy import func, select, union_all
 from flask_restx import Namespace, Resource, fields
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from models import db, Log, User
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from routes.user import admin_required
+from utils.accessJournal import access_journal
+from utils.logCodes import METHOD_UNKNOWN
+from utils.logArchive import log_sources, month_range
+from utils.logExport import export_logs, parquet_available, FORMATS
+from utils.logRollup import log_stats
+from utils.logWriter import log_writer, log_row
+from utils.pagination import after, decode_cursor, encode_cursor
+
+MAX_PER_PAGE = 500
 
 def make_log(
     user_id: int,
     access_granted: bool,
-    error_log: str | None = None
+    error_log: str | None = None,
+    method: int = METHOD_UNKNOWN
 ):
     """
-    Create and persist an access log entry.
-    """
-    log = Log(
-        user_id=user_id,
-        access_granted=access_granted,
-        error_log=error_log,
-    )
+    Record an access log entry.
 
-    db.session.add(log)
-    db.session.commit()
-
-    return log
+    Known messages are appended to the access journal (utils/accessJournal.py)
+    and compacted into the Log table in bulk; anything else goes to the
+    background log writer (utils/logWriter.py).
+    """
+    if access_journal.append(user_id, access_granted, method, error_log):
+        return
+    log_writer.write(log_row(user_id, access_granted, error_log, method))
 
 log_ns = Namespace('logs', description='Access log operations')
 
@@ -33,7 +40,8 @@ log_model = log_ns.model('Log', {
     'user_id': fields.Integer(description='User ID'),
     'access_granted': fields.Boolean(description='Whether access was granted'),
     'error_log': fields.String(description='Error message if access denied'),
-    'time': fields.String(description='Timestamp of access attempt'),
+    'method': fields.String(description='Access method (qr, face, face_stream)'),
+    'created_at': fields.String(description='Timestamp of access attempt'),
 })
 
 log_stats_model = log_ns.model('LogStats', {
@@ -61,6 +69,10 @@ log_stats_model = log_ns.model('LogStats', {
         description='Number of biometric-based access attempts',
         example=40
     ),
+    'methods': fields.Raw(
+        description='Access attempts per method (qr, face, face_stream, unknown)',
+        example={'qr': 80, 'face': 30, 'face_stream': 10, 'unknown': 0}
+    ),
     'recent_activity': fields.List(
         fields.Nested(log_model),
         description='Most recent access log entries'
@@ -69,9 +81,10 @@ log_stats_model = log_ns.model('LogStats', {
 
 log_list_model = log_ns.model('LogList', {
     'logs': fields.List(fields.Nested(log_model)),
-    'total': fields.Integer(description='Total number of logs'),
-    'page': fields.Integer(description='Current page number'),
-    'pages': fields.Integer(description='Total number of pages')
+    'next': fields.String(description='Cursor of the next page, null on the last page'),
+    'total': fields.Integer(description='Total number of logs (only with include_total or page)'),
+    'page': fields.Integer(description='Current page number (only with page)'),
+    'pages': fields.Integer(description='Total number of pages (only with page)')
 })
 
 user_log_list_model = log_ns.model('UserLogList', {
@@ -90,11 +103,15 @@ error_model = log_ns.model('Error', {
 @log_ns.route('/')
 class LogList(Resource):
     @log_ns.doc('get_logs',
-                description='Get access logs. Admins see all logs, regular users see only their own.',
+                description='Get access logs, newest first. Pass the returned `next` cursor to get the '
+                            'following page; `page` is still accepted but gets slower the deeper it goes.',
                 security='Bearer',
                 params={
-                    'page': {'description': 'Page number', 'type': 'integer', 'default': 1},
-                    'per_page': {'description': 'Items per page', 'type': 'integer', 'default': 50},
+                    'cursor': {'description': 'Opaque cursor from the previous response', 'type': 'string'},
+                    'per_page': {'description': 'Items per page (max 500)', 'type': 'integer', 'default': 50},
+                    'include_total': {'description': 'Also count all matching logs', 'type': 'boolean',
+                                      'default': False},
+                    'page': {'description': 'Page number (offset pagination, deprecated)', 'type': 'integer'},
                     'user_id': {'description': 'Filter by user ID (admin only)', 'type': 'integer'},
                     'access_granted': {'description': 'Filter by access status (true/false)', 'type': 'boolean'},
                     'start_date': {'description': 'Start date filter (ISO format)', 'type': 'string',
@@ -103,26 +120,24 @@ class LogList(Resource):
                                  'example': '2025-12-31T23:59:59'}
                 })
     @log_ns.response(200, 'Success', log_list_model)
-    @log_ns.response(400, 'Invalid date format', error_model)
+    @log_ns.response(400, 'Invalid date format or cursor', error_model)
     @log_ns.response(401, 'Unauthorized', error_model)
     @admin_required()
     def get(self):
         """Get access logs with optional filters (admin-only full access)"""
 
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
-
-        query = Log.query
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), MAX_PER_PAGE)
+        page = request.args.get('page', type=int)
+        include_total = request.args.get('include_total', 'false').lower() == 'true' or page is not None
 
-        # Admin can filter by user_id
-        if request.args.get('user_id'):
-            query = query.filter_by(user_id=request.args.get('user_id', type=int))
+        user_id = request.args.get('user_id', type=int)
+        access_granted = request.args.get('access_granted')
 
         # Start date filter
+        start_date = end_date = None
         if request.args.get('start_date'):
             try:
                 start_date = datetime.fromisoformat(request.args.get('start_date'))
-                query = query.filter(Log.time >= start_date)
             except ValueError:
                 return {'error': 'Invalid start_date format'}, 400
 
@@ -130,19 +145,128 @@ class LogList(Resource):
         if request.args.get('end_date'):
             try:
                 end_date = datetime.fromisoformat(request.args.get('end_date'))
-                query = query.filter(Log.time <= end_date)
             except ValueError:
                 return {'error': 'Invalid end_date format'}, 400
 
-        query = query.order_by(Log.created_at.desc())
-        logs = query.paginate(page=page, per_page=per_page, error_out=False)
+        key = None
+        if request.args.get('cursor'):
+            try:
+                key = decode_cursor(request.args.get('cursor'), datetime, int)
+            except ValueError:
+                return {'error': 'Invalid cursor'}, 400
+
+        def filtered(statement):
+            # Plain row tuples with the email joined in: one query per page and table
+            columns = statement.selected_columns
+            if user_id is not None:
+                statement = statement.where(columns.user_id == user_id)
+            if access_granted:
+                statement = statement.where(columns.access_granted == (access_granted.lower() == 'true'))
+            if start_date is not None:
+                statement = statement.where(columns.created_at >= start_date)
+            if end_date is not None:
+                statement = statement.where(columns.created_at <= end_date)
+            return statement
+
+        # The hot logs table plus any archived months overlapping the range
+        sources = [(filtered(Log.listing(table)), bound) for table, bound in log_sources(start_date, end_date)]
+
+        result = {}
+        if include_total:
+            result['total'] = sum(
+                db.session.execute(select(func.count()).select_from(statement.subquery())).scalar()
+                for statement, _ in sources
+            )
 
-        return {
-            'logs': [log.to_dict() for log in logs.items],
-            'total': logs.total,
-            'page': logs.page,
-            'pages': logs.pages
-        }, 200
+        if page is not None and key is None:
+            # Offset pagination has to look at every table at once
+            union = union_all(*(statement for statement, _ in sources)).subquery()
+            logs = db.session.execute(
+                select(union).order_by(union.c.created_at.desc(), union.c.id.desc())
+                .offset((max(page, 1) - 1) * per_page).limit(per_page + 1)
+            ).all()
+        else:
+            # One extra row tells whether there is a next page without counting
+            logs = []
+            for statement, bound in sources:
+                if bound is not None and len(logs) > per_page and bound <= logs[per_page].created_at:
+                    break  # this archive and every older one only hold older rows
+                columns = statement.selected_columns
+                if key is not None:
+                    statement = statement.where(after((columns.created_at, columns.id), key))
+                logs += db.session.execute(
+                    statement.order_by(columns.created_at.desc(), columns.id.desc()).limit(per_page + 1)
+                ).all()
+                logs.sort(key=lambda row: (row.created_at, row.id), reverse=True)
+                del logs[per_page + 1:]
+
+        has_more = len(logs) > per_page
+        logs = logs[:per_page]
+
+        result['logs'] = [Log.row_to_dict(log) for log in logs]
+        result['next'] = encode_cursor(logs[-1].created_at, logs[-1].id) if has_more else None
+        if page is not None:
+            result['page'] = max(page, 1)
+            result['pages'] = -(-result['total'] // per_page)
+        return result, 200
+
+@log_ns.route('/export')
+class LogExport(Resource):
+    @log_ns.doc('export_logs',
+                description='Stream all matching logs, oldest first, joined with the user email. '
+                            'Memory use does not depend on the number of rows exported. '
+                            'parquet needs the optional pyarrow package.',
+                security='Bearer',
+                params={
+                    'format': {'description': 'csv, ndjson or parquet', 'type': 'string', 'default': 'csv'},
+                    'month': {'description': 'Export one month (YYYY-MM)', 'type': 'string',
+                              'example': '2025-01'},
+                    'start_date': {'description': 'Start date filter (ISO format)', 'type': 'string'},
+                    'end_date': {'description': 'End date filter, exclusive (ISO format)', 'type': 'string'},
+                    'user_id': {'description': 'Filter by user ID', 'type': 'integer'},
+                    'access_granted': {'description': 'Filter by access status (true/false)', 'type': 'boolean'},
+                })
+    @log_ns.response(200, 'Export stream')
+    @log_ns.response(400, 'Invalid format or date', error_model)
+    @log_ns.response(401, 'Unauthorized', error_model)
+    @admin_required()
+    def get(self):
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in FORMATS:
+            return {'error': f'Unknown format, expected one of {", ".join(FORMATS)}'}, 400
+        if fmt == 'parquet' and not parquet_available():
+            return {'error': 'parquet export needs the pyarrow package'}, 400
+
+        try:
+            if request.args.get('month'):
+                start, end = month_range(request.args.get('month'))
+            else:
+                start = datetime.fromisoformat(request.args['start_date']) if request.args.get('start_date') else None
+                end = datetime.fromisoformat(request.args['end_date']) if request.args.get('end_date') else None
+        except ValueError:
+            return {'error': 'Invalid month or date format'}, 400
+
+        access_granted = request.args.get('access_granted')
+        chunks = export_logs(
+            fmt,
+            batch_size=current_app.config.get('LOG_EXPORT_BATCH_SIZE', 5000),
+            start=start,
+            end=end,
+            user_id=request.args.get('user_id', type=int),
+            access_granted=access_granted.lower() == 'true' if access_granted else None,
+        )
+
+        mimetype, extension = FORMATS[fmt]
+        name = f"logs-{request.args.get('month') or datetime.utcnow().strftime('%Y%m%d')}.{extension}"
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={name}'})
+
+@log_ns.route('/writer')
+class LogWriterStats(Resource):
+    @log_ns.doc('get_log_writer', description='Queue depth and counters of the background log writer (admin only)')
+    @admin_required()
+    def get(self):
+        return log_writer.report(), 200
 
 @log_ns.route('/stats')
 class LogStats(Resource):
@@ -155,45 +279,15 @@ class LogStats(Resource):
     @log_ns.response(200, 'Success', log_stats_model)
     @log_ns.response(401, 'Unauthorized', error_model)
     @log_ns.response(403, 'Admin privileges required', error_model)
-    @jwt_required()
+    @admin_required()
     def get(self):
         """Get log statistics (admin only)"""
-        claims = get_jwt()
-        if not claims.get('is_admin', False):
-            return {'error': 'Admin privileges required'}, 403
-
         days = request.args.get('days', 7, type=int)
-        time_threshold = datetime.utcnow() - timedelta(days=days)
-
-        total_attempts = Log.query.filter(Log.time >= time_threshold).count()
-        successful_attempts = Log.query.filter(
-            Log.time >= time_threshold,
-            Log.access_granted == True
-        ).count()
-        failed_attempts = Log.query.filter(
-            Log.time >= time_threshold,
-            Log.access_granted == False
-        ).count()
-
-        success_rate = (successful_attempts / total_attempts * 100) if total_attempts > 0 else 0
-
-        unique_users = db.session.query(Log.user_id).filter(
-            Log.time >= time_threshold
-        ).distinct().count()
-
-        biometric_attempts = Log.query.filter(
-            Log.time >= time_threshold,
-            Log.biometric_hash.isnot(None)
-        ).count()
-
-        recent_logs = Log.query.order_by(Log.time.desc()).limit(10).all()
-
-        return {
-            'total_attempts': total_attempts,
-            'successful_attempts': successful_attempts,
-            'failed_attempts': failed_attempts,
-            'success_rate': round(success_rate, 2),
-            'unique_users': unique_users,
-            'biometric_attempts': biometric_attempts,
-            'recent_activity': [log.to_dict() for log in recent_logs]
-        }, 200
\ No newline at end of file
+
+        # Counters come from the hourly/daily rollups, not from scanning logs
+        stats = log_stats(days)
+
+        recent_logs = Log.query.options(Log.eager_user()).order_by(Log.created_at.desc()).limit(10).all()
+        stats['recent_activity'] = [log.to_dict() for log in recent_logs]
+
+        return stats, 200
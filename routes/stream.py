@@ -0,0 +1,147 @@
+import base64
+import json
+import queue
+
+import cv2
+import numpy as np
+from flask import current_app, request
+from flask_sock import Sock
+
+from models import User
+from routes.log import make_log
+from utils.expirySweeper import expired_users
+from utils.faceIndex import face_index
+from utils.faceRecognition import match_templates, MATCH_THRESHOLD
+from utils.imageUpload import decode
+from utils.inference import inference_service, InferenceError, InferenceTimeout
+from utils.logCodes import METHOD_FACE_STREAM
+
+sock = Sock()
+
+
+class FaceStreamSession:
+    """
+    Decision state for one door terminal streaming camera frames.
+
+    Frames are matched one by one until a frame passes the threshold
+    (accept) or ``max_failures`` processed frames did not (reject). Frames
+    that barely differ from the last processed one are skipped, since
+    running the models again would give the same answer.
+    """
+
+    def __init__(self, user=None, max_failures=5, duplicate_threshold=4.0, mode='max'):
+        self.user = user  # None: identify against the whole gallery
+        self.templates = user.get_templates() if user is not None else None
+        self.mode = mode
+        self.max_failures = max_failures
+        self.duplicate_threshold = duplicate_threshold
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.best = 0.0
+        self._previous = None
+
+    def _thumbnail(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def is_duplicate(self, thumbnail):
+        if self._previous is None:
+            return False
+        return float(np.abs(thumbnail - self._previous).mean()) < self.duplicate_threshold
+
+    def match(self, embedding):
+        if embedding is None:
+            return None, 0.0
+        if self.user is not None:
+            return self.user.id, match_templates(embedding, self.templates, self.mode)
+        matches = face_index.search(embedding, k=1, aggregate=self.mode)
+        return matches[0] if matches else (None, 0.0)
+
+    def feed(self, image):
+        """Process one frame and return the decision to send to the terminal."""
+        thumbnail = self._thumbnail(image)
+        if self.is_duplicate(thumbnail):
+            return {'status': 'skipped', 'failures': self.failures}
+        try:
+            embedding = inference_service.embed(image)
+        except Exception:
+            self._previous = None  # not processed, so the next similar frame is tried again
+            raise
+        self._previous = thumbnail
+
+        user_id, score = self.match(embedding)
+        self.best = max(self.best, score)
+        if user_id is not None and score > MATCH_THRESHOLD:
+            self.reset()
+            if user_id in expired_users:
+                make_log(user_id, False, "Account expired", METHOD_FACE_STREAM)
+                return {'status': 'rejected', 'msg': 'Konto wygasło', 'similarity': score}
+            make_log(user_id, True, "access granted", METHOD_FACE_STREAM)
+            return {'status': 'accepted', 'user_id': user_id, 'similarity': score}
+
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            best = self.best
+            self.reset()
+            make_log(self.user.id if self.user else -1, False, "face not recognized", METHOD_FACE_STREAM)
+            return {'status': 'rejected', 'similarity': best}
+        return {'status': 'pending', 'failures': self.failures, 'similarity': score}
+
+
+def decode_frame(message):
+    """Binary messages are encoded images, text messages base64 or data URLs."""
+    if isinstance(message, str):
+        try:
+            message = base64.b64decode(message.split(',')[-1])
+        except ValueError:
+            return None
+    image, _ = decode(np.frombuffer(message, np.uint8))
+    return image
+
+
+@sock.route('/auth/face/stream')
+def face_stream(ws):
+    """
+    Stream frames from a door terminal over one WebSocket connection.
+
+    Optional ``?email=`` switches from identification to 1:1 verification.
+    Every frame gets a JSON reply with status pending, skipped, accepted or
+    rejected; after a decision the session starts over for the next person.
+    A frame the model could not process gets busy or error instead.
+    """
+    user = None
+    email = request.args.get('email')
+    if email:
+        user = User.query.filter_by(email=email).first()
+        if not user:
+            make_log(-1, False, "Face not recognized", METHOD_FACE_STREAM)
+            ws.send(json.dumps({'status': 'error', 'msg': 'Nie znaleziono użytkownika'}))
+            return
+
+    session = FaceStreamSession(
+        user,
+        max_failures=current_app.config.get('FACE_STREAM_MAX_FAILURES', 5),
+        duplicate_threshold=current_app.config.get('FACE_STREAM_DUPLICATE_THRESHOLD', 4.0),
+        mode=current_app.config.get('FACE_TEMPLATE_MATCH', 'max'),
+    )
+    while True:
+        message = ws.receive()
+        if message is None:
+            return
+
+        image = decode_frame(message)
+        if image is None:
+            ws.send(json.dumps({'status': 'error', 'msg': 'Nieprawidłowy obraz'}))
+            continue
+
+        # The terminal keeps streaming, so a failed frame must not end the connection
+        try:
+            result = session.feed(image)
+        except (queue.Full, InferenceTimeout):
+            result = {'status': 'busy', 'msg': 'Serwer zajęty, spróbuj ponownie'}
+        except InferenceError:
+            current_app.logger.exception('Face embedding failed')
+            result = {'status': 'error', 'msg': 'Błąd rozpoznawania twarzy'}
+        ws.send(json.dumps(result))
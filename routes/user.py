@@ -1,17 +1,38 @@
-import cv2
-import numpy as np
-from flask import request
+import os
+import queue
+import shutil
+import tempfile
+import zipfile
+
+from flask import current_app, g, request
 from flask_restx import Namespace, Resource, fields
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, verify_jwt_in_request
+from flask_jwt_extended import jwt_required, get_jwt, verify_jwt_in_request
 from jwt import ExpiredSignatureError
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.exc import IntegrityError
 
-from models import db, User
+from models import db, User, EnrollmentJob
 from datetime import datetime, date, timedelta
 from functools import wraps
-from utils.faceRecognition import get_embedding
+from utils.bulkEnroll import enrollment_jobs
+from utils.bulkUsers import create_users, extend_expiry, DEFAULT_DAYS
+from utils.embeddingCodec import format_code
+from utils.expirySweeper import expired_users
+from utils.faceIndex import face_index
+from utils.identityCache import current_identity, identity_cache, load_identity
+from utils.imageUpload import read_request_image
+from utils.inference import inference_service, InferenceError, InferenceTimeout
+from utils.pagination import after, decode_cursor, encode_cursor
+from utils.qrCode import revocations, rotate_qr_token
 
 user_ns = Namespace('users', description='User management operations')
 
+MAX_PER_PAGE = 500
+
+# Fields of GET /users; qr_token has to be asked for explicitly
+USER_FIELDS = tuple(User.listing_columns())
+DEFAULT_USER_FIELDS = ('id', 'email', 'is_admin', 'expire_time', 'created_at')
+
 # Models for Swagger documentation
 user_model = user_ns.model('User', {
     'id': fields.Integer(description='User ID', readonly=True),
@@ -38,11 +59,37 @@ user_stats_model = user_ns.model('UserStats', {
     'users_with_biometric': fields.Integer(description='Users with biometric utils enabled')
 })
 
+user_list_model = user_ns.model('UserList', {
+    'users': fields.List(fields.Raw, description='Users with the requested fields'),
+    'next': fields.String(description='Cursor of the next page, null on the last page'),
+    'total': fields.Integer(description='Number of matching users (only with include_total)'),
+})
+
 message_model = user_ns.model('Message', {
     'message': fields.String(description='Success message'),
     'user': fields.Nested(user_model)
 })
 
+bulk_user_model = user_ns.model('BulkUser', {
+    'email': fields.String(required=True, description='User email'),
+    'password': fields.String(required=False, description='User password (default: the /auth/create default)'),
+    'days': fields.Integer(required=False, description='Days until expiration (default: request days)'),
+})
+
+bulk_create_model = user_ns.model('BulkCreate', {
+    'users': fields.List(fields.Nested(bulk_user_model), required=True),
+    'days': fields.Integer(required=False, description='Default days until expiration', default=100),
+})
+
+bulk_expiry_model = user_ns.model('BulkExpiry', {
+    'days': fields.Integer(required=True, description='Days to add to the current (or, if past, to now) expiry'),
+    'user_ids': fields.List(fields.Integer, required=False),
+    'emails': fields.List(fields.String, required=False),
+    'email_prefix': fields.String(required=False),
+    'expired': fields.Boolean(required=False, description='Only expired (true) or active (false) users'),
+    'all': fields.Boolean(required=False, description='Required to extend every user when no filter is given'),
+})
+
 error_model = user_ns.model('Error', {
     'error': fields.String(description='Error message')
 })
@@ -62,12 +109,13 @@ def admin_required():
                 return {'error': 'Token has expired'}, 401
             except Exception as e:
                 return {'error': str(e)}, 401
-            email = claims.get('sub')
-            user = User.query.filter_by(email=email).first()
-            if not user:
+            # Cached id/admin flag instead of a users query on every call
+            identity = load_identity(claims.get('sub'))
+            if not identity:
                 return {'error': 'User does not exist'}, 401
+            g.identity = identity
 
-            if not user.is_admin:
+            if not identity.is_admin:
                 return {'error': 'Admin privileges required'}, 403
 
             return fn(*args, **kwargs)
@@ -80,19 +128,149 @@ def admin_required():
 @user_ns.route('/')
 class UserList(Resource):
     @user_ns.doc('get_users',
-                 description='Get all users (admin only) or current user information')
+                 description='List users (admin only), ordered by email. Pass the returned `next` cursor '
+                             'to get the following page.',
+                 params={
+                     'cursor': {'description': 'Opaque cursor from the previous response', 'type': 'string'},
+                     'per_page': {'description': 'Items per page (max 500)', 'type': 'integer', 'default': 50},
+                     'include_total': {'description': 'Also count all matching users', 'type': 'boolean',
+                                       'default': False},
+                     'email': {'description': 'Email prefix search', 'type': 'string'},
+                     'status': {'description': 'expired or active', 'type': 'string'},
+                     'has_biometric': {'description': 'Filter by enrolled face (true/false)', 'type': 'boolean'},
+                     'fields': {'description': f'Comma separated subset of {", ".join(USER_FIELDS)}',
+                                'type': 'string', 'default': ','.join(DEFAULT_USER_FIELDS)},
+                 })
     @user_ns.response(401, 'Unauthorized', error_model)
-    @user_ns.response(200, 'List of all users(admin)/ one user', user_stats_model)
+    @user_ns.response(400, 'Invalid filter, fields or cursor', error_model)
+    @user_ns.response(200, 'Page of users', user_list_model)
     @admin_required()
     def get(self):
-        """Get all users (admin) or current user"""
-        users = User.query.all()
-
+        """List users with filters, projection and cursor pagination"""
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), MAX_PER_PAGE)
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+
+        fields = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+        fields = fields or list(DEFAULT_USER_FIELDS)
+        unknown = [name for name in fields if name not in USER_FIELDS]
+        if unknown:
+            return {'error': f'Unknown fields: {", ".join(unknown)}'}, 400
+
+        filters = []
+        prefix = request.args.get('email')
+        if prefix:
+            # A range instead of LIKE, so it is a scan of the (binary) email index
+            filters.append(User.email >= prefix)
+            following = ord(prefix[-1]) + 1
+            if following == 0xD800:
+                following = 0xE000  # surrogates cannot be encoded, the next string starts after them
+            if following <= 0x10FFFF:
+                filters.append(User.email < prefix[:-1] + chr(following))
+            else:
+                filters.append(User.email.startswith(prefix, autoescape=True))
+
+        status = request.args.get('status')
+        if status:
+            now = datetime.now()
+            if status == 'expired':
+                filters.append(User.expire_time < now)
+            elif status == 'active':
+                filters.append(or_(User.expire_time >= now, User.expire_time.is_(None)))
+            else:
+                return {'error': 'status must be expired or active'}, 400
+
+        has_biometric = request.args.get('has_biometric')
+        if has_biometric:
+            clause = User.has_biometric_clause()
+            filters.append(clause if has_biometric.lower() == 'true' else ~clause)
+
+        result = {}
+        if include_total:
+            result['total'] = db.session.execute(select(func.count(User.id)).where(*filters)).scalar()
+
+        if request.args.get('cursor'):
+            try:
+                key = decode_cursor(request.args.get('cursor'), str)
+            except ValueError:
+                return {'error': 'Invalid cursor'}, 400
+            filters.append(after((User.email,), key, descending=False))
+
+        # email is always fetched: it is the sort and cursor key
+        rows = db.session.execute(
+            User.listing(dict.fromkeys(fields + ['email'])).where(*filters).order_by(User.email).limit(per_page + 1)
+        ).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+
+        result['users'] = [{name: user[name] for name in fields} for user in map(User.row_to_dict, rows)]
+        result['next'] = encode_cursor(rows[-1].email) if has_more else None
+        return result, 200
+
+
+@user_ns.route('/expiring')
+class UserExpiring(Resource):
+    @user_ns.doc('get_expiring_users',
+                 description='Users whose account expires within the next `days` days, soonest first '
+                             '(admin only). Served from the expire_time index.',
+                 params={
+                     'days': {'description': 'Look-ahead window in days', 'type': 'integer', 'default': 7},
+                     'cursor': {'description': 'Opaque cursor from the previous response', 'type': 'string'},
+                     'per_page': {'description': 'Items per page (max 500)', 'type': 'integer', 'default': 50},
+                 })
+    @user_ns.response(200, 'Page of users', user_list_model)
+    @user_ns.response(400, 'Invalid cursor', error_model)
+    @user_ns.response(401, 'Unauthorized', error_model)
+    @admin_required()
+    def get(self):
+        """Upcoming account expirations"""
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), MAX_PER_PAGE)
+        now = datetime.now()
+        until = now + timedelta(days=request.args.get('days', 7, type=int))
+
+        statement = User.listing(['id', 'email', 'expire_time']) \
+            .where(User.expire_time >= now, User.expire_time < until)
+        if request.args.get('cursor'):
+            try:
+                key = decode_cursor(request.args.get('cursor'), datetime, int)
+            except ValueError:
+                return {'error': 'Invalid cursor'}, 400
+            statement = statement.where(after((User.expire_time, User.id), key, descending=False))
+
+        rows = db.session.execute(statement.order_by(User.expire_time, User.id).limit(per_page + 1)).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
         return {
-            'users': [user.to_dict() for user in users],
+            'users': [User.row_to_dict(row) for row in rows],
+            'next': encode_cursor(rows[-1].expire_time, rows[-1].id) if has_more else None,
         }, 200
 
 
+@user_ns.route('/stats')
+class UserStats(Resource):
+    @user_ns.doc('get_user_stats', description='User counts (admin only)')
+    @user_ns.response(200, 'Success', user_stats_model)
+    @user_ns.response(401, 'Unauthorized', error_model)
+    @admin_required()
+    @user_ns.marshal_with(user_stats_model)
+    def get(self):
+        """User statistics from one GROUP BY query"""
+        expired = case((User.expire_time < datetime.now(), True), else_=False).label('expired')
+        has_biometric = case((User.has_biometric_clause(), True), else_=False).label('has_biometric')
+        groups = db.session.execute(
+            select(User.is_admin, expired, has_biometric, func.count(User.id))
+            .group_by(User.is_admin, expired, has_biometric)
+        ).all()
+
+        stats = dict.fromkeys(['total_users', 'admin_users', 'regular_users', 'expired_users',
+                               'users_with_biometric'], 0)
+        for is_admin, is_expired, is_enrolled, count in groups:
+            stats['total_users'] += count
+            stats['admin_users' if is_admin else 'regular_users'] += count
+            stats['expired_users'] += count if is_expired else 0
+            stats['users_with_biometric'] += count if is_enrolled else 0
+        return stats
+
+
 @user_ns.route('/<int:user_id>')
 class UserDetail(Resource):
     @user_ns.doc('get_user',
@@ -125,8 +303,6 @@ class UserDetail(Resource):
     @user_ns.response(500, 'Internal server error', error_model)
     @admin_required()
     def put(self, user_id):
-        identity = get_jwt_identity()
-        user = User.query.filter_by(email=identity).first()
         """Update user information"""
         user = User.query.get(user_id)
         if not user:
@@ -143,8 +319,13 @@ class UserDetail(Resource):
                 else:
                     days = int(days)
                     user.expire_time = user.expire_time + timedelta(days=days)
+                    # The expiry is part of the QR token, so it has to be reissued
+                    rotate_qr_token(user)
 
             db.session.commit()
+            identity_cache.invalidate(user_id=user.id)
+            if not user.is_expired():
+                expired_users.discard([user.id])
 
             return {
                 'message': 'User updated successfully',
@@ -171,10 +352,7 @@ class UserDetail(Resource):
     @admin_required()
     def delete(self, user_id):
         """Delete user (admin only)"""
-        identity = get_jwt_identity()
-        user =User.query.filter_by(email=identity).first()
-
-        if user.id == user_id:
+        if current_identity().id == user_id:
             return {'error': 'Cannot delete your own account'}, 400
 
         user = User.query.get(user_id)
@@ -183,7 +361,11 @@ class UserDetail(Resource):
 
         try:
             db.session.delete(user)
+            # A user created later with the same id starts at this version (first_token_versions)
+            revocations.revoke(user_id, (user.token_version or 0) + 1)
             db.session.commit()
+            identity_cache.invalidate(user_id=user_id)
+            face_index.remove(user_id)
 
             return {'message': 'User deleted successfully'}, 200
 
@@ -191,6 +373,73 @@ class UserDetail(Resource):
             db.session.rollback()
             return {'error': str(e)}, 500
 
+@user_ns.route('/bulk')
+class UserBulk(Resource):
+    @user_ns.doc('bulk_create_users',
+                 description='Create many users in one transaction (admin only). '
+                             'Returns a result per user with its id and QR token.')
+    @user_ns.expect(bulk_create_model)
+    @user_ns.response(200, 'Report with a result per requested user')
+    @user_ns.response(400, 'Validation error', error_model)
+    @user_ns.response(503, 'Password hashing busy', error_model)
+    @admin_required()
+    def post(self):
+        """Bulk user creation"""
+        data = user_ns.payload or {}
+        users = data.get('users')
+        if not isinstance(users, list) or not users:
+            return {'error': 'users must be a non-empty list'}, 400
+        limit = current_app.config.get('USER_BULK_MAX', 1000)
+        if len(users) > limit:
+            return {'error': f'At most {limit} users per request'}, 400
+
+        try:
+            return create_users(users, default_days=data.get('days') or DEFAULT_DAYS), 200
+        except queue.Full:
+            db.session.rollback()
+            return {'error': 'Server busy, try again'}, 503
+        except IntegrityError:
+            # An email was taken between the duplicate check and the insert
+            db.session.rollback()
+            return {'error': 'Email already exists, retry the request'}, 409
+
+
+@user_ns.route('/bulk/expiry')
+class UserBulkExpiry(Resource):
+    @user_ns.doc('bulk_extend_expiry',
+                 description='Extend expire_time of every user matching the filters with one UPDATE (admin only). '
+                             'QR tokens of the extended users are reissued.')
+    @user_ns.expect(bulk_expiry_model)
+    @user_ns.response(200, 'Report with a result per updated or missing user')
+    @user_ns.response(400, 'Validation error', error_model)
+    @admin_required()
+    def post(self):
+        """Bulk expiry extension"""
+        data = user_ns.payload or {}
+        try:
+            days = int(data.get('days'))
+            user_ids = [int(user_id) for user_id in data.get('user_ids') or []]
+        except (TypeError, ValueError):
+            return {'error': 'days and user_ids must be numbers'}, 400
+        emails = data.get('emails') or []
+        email_prefix = data.get('email_prefix')
+        expired = data.get('expired')
+        # A string such as "false" would otherwise select the opposite users
+        if expired is not None and not isinstance(expired, bool):
+            return {'error': 'expired must be true or false'}, 400
+        if data.get('all') not in (None, True, False):
+            return {'error': 'all must be true or false'}, 400
+        if not (user_ids or emails or email_prefix or expired is not None or data.get('all') is True):
+            return {'error': 'Give user_ids, emails, email_prefix or expired, or all=true'}, 400
+
+        try:
+            return extend_expiry(days, user_ids=user_ids, emails=emails,
+                                 email_prefix=email_prefix, expired=expired), 200
+        except Exception as e:
+            db.session.rollback()
+            return {'error': str(e)}, 500
+
+
 @user_ns.route('/<int:user_id>/photo')
 class UserPhoto(Resource):
 
@@ -199,28 +448,86 @@ class UserPhoto(Resource):
         if not user:
             return {"message": "User not found"}, 404
 
-        if 'photo' not in request.files:
-            return {"message": "No photo provided"}, 400
-
-        file = request.files['photo']
-
-        # --- read image ---
-        np_img = np.frombuffer(file.read(), np.uint8)
-        img = cv2.imdecode(np_img, cv2.IMREAD_COLOR)
-
+        # --- read image (multipart 'photo' or raw image body) ---
+        img, error = read_request_image('photo', max_bytes=current_app.config.get('FACE_MAX_UPLOAD_BYTES'))
         if img is None:
-            return {"message": "Invalid image"}, 400
+            return {"message": error}, 400
 
         # --- compute embedding ---
-        embedding = get_embedding(img)
+        try:
+            embedding = inference_service.embed(img)
+        except (queue.Full, InferenceTimeout):
+            return {"message": "Face recognition is busy, try again"}, 503
+        except InferenceError:
+            current_app.logger.exception('Face embedding failed')
+            return {"message": "Face recognition failed"}, 500
         if embedding is None:
             return {"message": "No face detected"}, 400
 
-        # --- save embedding ---
-        user.biometric_hash = embedding.tolist()
+        # --- save embedding as one more template ---
+        templates = user.add_template(
+            embedding,
+            format_code(current_app.config.get('FACE_EMBEDDING_FORMAT', 'float32')),
+            max_templates=current_app.config.get('FACE_MAX_TEMPLATES', 5),
+        )
         db.session.commit()
+        face_index.add(user.id, templates if face_index.use_templates else user.get_embedding())
 
         return {
             "message": "Photo processed successfully",
-            "user_id": user.id
-        }, 200
\ No newline at end of file
+            "user_id": user.id,
+            "templates": len(templates)
+        }, 200
+
+
+@user_ns.route('/photos/bulk')
+class UserPhotoBulk(Resource):
+    @user_ns.doc('bulk_enroll',
+                 description='Enroll many users at once from a zip of <email>.jpg photos (admin only). '
+                             'Send the archive as multipart "archive" or as an application/zip body. '
+                             'The archive is processed in the background; poll status_url for the report '
+                             '(enroll.py runs the same enrollment synchronously).')
+    @user_ns.response(202, 'Enrollment queued, with the job id and status URL')
+    @user_ns.response(400, 'No archive provided', error_model)
+    @user_ns.response(503, 'Too many archives waiting', error_model)
+    @admin_required()
+    def post(self):
+        """Bulk face enrollment"""
+        upload = request.files.get('archive')
+        if upload is None and request.mimetype not in ('application/zip', 'application/octet-stream'):
+            return {'error': 'No archive provided'}, 400
+
+        fd, path = tempfile.mkstemp(suffix='.zip')
+        queued = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(upload.stream if upload else request.stream, f)
+            if not zipfile.is_zipfile(path):
+                return {'error': 'Archive is not a valid zip file'}, 400
+
+            try:
+                job_id = enrollment_jobs.submit(path)
+            except queue.Full:
+                return {'error': 'Server busy, try again'}, 503
+            queued = True  # the job removes the archive once processed
+        finally:
+            if not queued:
+                os.remove(path)
+
+        status_url = f'/users/photos/bulk/{job_id}'
+        return {'job_id': job_id, 'status': 'queued', 'status_url': status_url}, 202, {'Location': status_url}
+
+@user_ns.route('/photos/bulk/<int:job_id>')
+class UserPhotoBulkJob(Resource):
+    @user_ns.doc('bulk_enroll_status',
+                 description='Status of a bulk enrollment job (queued, running, done or failed) '
+                             'and its report once done (admin only)')
+    @user_ns.response(200, 'Job status')
+    @user_ns.response(404, 'Job not found', error_model)
+    @admin_required()
+    def get(self, job_id):
+        """Bulk enrollment status"""
+        job = db.session.get(EnrollmentJob, job_id)
+        if job is None:
+            return {'error': 'Job not found'}, 404
+        return job.to_dict(), 200
@@ -0,0 +1,55 @@
+import io
+import os
+import sys
+import time
+import zipfile
+
+import pytest
+
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'test-jwt-secret')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from __init__ import create_app  # noqa: E402
+from config import TestingConfig  # noqa: E402
+from models import db  # noqa: E402
+
+
+class BulkEnrollConfig(TestingConfig):
+    JWT_COOKIE_SECURE = False
+
+
+@pytest.fixture
+def client():
+    app = create_app(BulkEnrollConfig)
+    client = app.test_client()
+    response = client.post('/auth/login', json={'email': app.config['ADMIN_EMAIL'],
+                                                'password': app.config['ADMIN_PASS']})
+    assert response.status_code == 200
+    yield client
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_bulk_enroll_is_queued_and_reported(client):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('nobody@example.com.jpg', b'not decoded: the user does not exist')
+
+    response = client.post('/users/photos/bulk', data=archive.getvalue(), content_type='application/zip')
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    assert response.headers['Location'] == status_url
+
+    deadline = time.monotonic() + 10
+    while True:
+        job = client.get(status_url).get_json()
+        if job['status'] in ('done', 'failed') or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+
+    assert job['status'] == 'done', job
+    assert job['report']['total'] == 1
+    assert job['report']['failures'] == {'unknown_user': 1}
+    assert client.get('/users/photos/bulk/999').status_code == 404
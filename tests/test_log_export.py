@@ -0,0 +1,52 @@
+import io
+import os
+import sys
+
+import pytest
+from sqlalchemy import insert
+
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'test-jwt-secret')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from __init__ import create_app  # noqa: E402
+from config import TestingConfig  # noqa: E402
+from models import db, Log  # noqa: E402
+from utils.logCodes import METHOD_QR, METHOD_FACE  # noqa: E402
+
+
+class ExportConfig(TestingConfig):
+    JWT_COOKIE_SECURE = False
+
+
+@pytest.fixture
+def client():
+    app = create_app(ExportConfig)
+    with app.app_context():
+        db.session.execute(insert(Log), [
+            {'user_id': 1, 'access_granted': True, 'error_log': None, 'method': METHOD_QR},
+            {'user_id': -1, 'access_granted': False, 'error_log': 'Face not recognized', 'method': METHOD_FACE},
+        ])
+        db.session.commit()
+    client = app.test_client()
+    response = client.post('/auth/login', json={'email': app.config['ADMIN_EMAIL'],
+                                                'password': app.config['ADMIN_PASS']})
+    assert response.status_code == 200
+    yield client
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def test_parquet_export_reads_back(client):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    response = client.get('/log/export?format=parquet')
+    assert response.status_code == 200
+
+    rows = pq.read_table(io.BytesIO(response.data)).to_pylist()
+    assert [(row['user_id'], row['access_granted'], row['method'], row['error_log']) for row in rows] == [
+        (1, True, 'qr', None),
+        (-1, False, 'face', 'Face not recognized'),
+    ]
+    assert rows[0]['user_email'] == ExportConfig.ADMIN_EMAIL
@@ -0,0 +1,86 @@
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, insert
+
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('JWT_SECRET_KEY', 'test-jwt-secret')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from __init__ import create_app  # noqa: E402
+from config import TestingConfig  # noqa: E402
+from models import db, Log, User  # noqa: E402
+
+
+class QueryCountConfig(TestingConfig):
+    JWT_COOKIE_SECURE = False
+
+
+@pytest.fixture
+def app():
+    app = create_app(QueryCountConfig)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    response = client.post('/auth/login', json={'email': app.config['ADMIN_EMAIL'],
+                                                'password': app.config['ADMIN_PASS']})
+    assert response.status_code == 200
+    return client
+
+
+def add_logs(app, users, logs_per_user):
+    with app.app_context():
+        ids = []
+        for index in range(users):
+            user = User(email=f'door-{users}-{index}@example.com')
+            user.set_password('secret')
+            db.session.add(user)
+            db.session.flush()
+            ids.append(user.id)
+        db.session.execute(insert(Log), [
+            {'user_id': user_id, 'access_granted': number % 2 == 0, 'error_log': None, 'method': 1}
+            for user_id in ids for number in range(logs_per_user)
+        ])
+        db.session.commit()
+
+
+@contextmanager
+def count_queries(app):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.mark.parametrize('path', ['/log/?per_page=50', '/log/?per_page=50&include_total=true', '/log/stats'])
+def test_log_listing_runs_constant_number_of_queries(app, client, path):
+    add_logs(app, users=2, logs_per_user=2)
+    client.get(path)  # warm up per-worker caches (identity cache)
+    with count_queries(app) as few:
+        assert client.get(path).status_code == 200
+
+    add_logs(app, users=25, logs_per_user=4)
+    with count_queries(app) as many:
+        response = client.get(path)
+    assert response.status_code == 200
+
+    body = response.get_json()
+    rows = body['logs'] if 'logs' in body else body['recent_activity']
+    assert all(row['user_email'] for row in rows)
+    assert len(many) == len(few), many
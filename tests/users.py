@@ -13,12 +13,15 @@ login_response = session.post(f"{BASE_URL}/auth/login", json=login_data)
 
 print(login_response.cookies)
 
-for i in range(1, 21):
-    user = {
+users = [
+    {
         "email": f"user{i}@example.com",
-        "days": f"{i}"
+        "days": i
     }
+    for i in range(1, 21)
+]
 
-    response = session.post(f"{BASE_URL}/users", json=user)
+response = session.post(f"{BASE_URL}/users/bulk", json={"users": users})
 
-    print(i, response.status_code, response.json())
\ No newline at end of file
+for result in response.json()["results"]:
+    print(result["email"], result["status"], result.get("error") or result.get("id"))
@@ -0,0 +1,318 @@
+import atexit
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: foreign segments are only replayed at startup
+    fcntl = None
+
+import numpy as np
+from sqlalchemy import delete, insert
+
+from models import db, Log, JournalCheckpoint
+from utils.logCodes import error_code, ERROR_MESSAGES
+from utils.logRollup import update_rollups
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'IOJ1'
+HEADER = struct.Struct('<4sII')  # magic, record size, capacity
+HEADER_SIZE = 64
+
+# timestamp (unix microseconds, 0 = free slot), user_id, granted, method, error code
+RECORD = struct.Struct('<qiBBH')
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<i8'), ('user_id', '<i4'), ('granted', 'u1'), ('method', 'u1'), ('error', '<u2'),
+])
+
+
+class Segment:
+    """
+    One journal file: a small header followed by ``capacity`` fixed-size
+    records, written through a shared memory map.
+
+    Records are appended in order and a slot is only in use once its
+    timestamp is set, so after a crash the valid records are the prefix
+    before the first zero timestamp.
+    """
+
+    def __init__(self, path, capacity=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        create = capacity is not None
+        self._file = open(path, 'w+b' if create else 'r+b')
+        if create:
+            self._file.truncate(HEADER_SIZE + capacity * RECORD.size)
+            self._file.write(HEADER.pack(MAGIC, RECORD.size, capacity))
+            self._file.flush()
+        else:
+            magic, record_size, capacity = HEADER.unpack(self._file.read(HEADER.size))
+            if magic != MAGIC or record_size != RECORD.size:
+                self._file.close()
+                raise ValueError(f'{path} is not an access journal segment')
+        self.capacity = capacity
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        self.count = 0 if create else self._recover_count()
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def lock(self, blocking=True):
+        """Take the owner lock; a segment whose lock is free belongs to no live process."""
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+
+    def append(self, timestamp, user_id, granted, method, code):
+        RECORD.pack_into(self._mm, HEADER_SIZE + self.count * RECORD.size,
+                         timestamp, user_id, granted, method, code)
+        self.count += 1
+
+    def read(self, start, stop):
+        """Copy records [start, stop) out of the map."""
+        return np.frombuffer(self._mm, RECORD_DTYPE, count=stop - start,
+                             offset=HEADER_SIZE + start * RECORD.size).copy()
+
+    def _recover_count(self):
+        free = np.flatnonzero(self.read(0, self.capacity)['timestamp'] == 0)
+        return int(free[0]) if len(free) else self.capacity
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def remove(self):
+        """Delete the file, unlinking it before the owner lock is released where possible."""
+        if fcntl is None:
+            self.close()
+            os.remove(self.path)
+        else:
+            os.remove(self.path)
+            self.close()
+
+
+class AccessJournal:
+    """
+    Append-only, memory-mapped journal of door events.
+
+    make_log() appends a 16-byte record here, which costs a struct pack
+    into shared memory instead of a database transaction. A compactor
+    thread bulk-loads new records into the Log table every
+    ``compact_interval_ms``, storing how far each segment got in
+    JournalCheckpoint within the same transaction, so every record is
+    loaded exactly once.
+
+    Each process writes its own segments and holds an flock on them; the
+    compactor starts with the first event a process journals, so workers
+    forked from a pre-loading server get their own. Segments whose lock is
+    free were left behind by a crashed process and are replayed by
+    whichever process compacts next. Records survive a
+    process crash as soon as they are appended; flush() after each
+    compaction also covers the loss of the machine up to that point.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._segments = {}  # own segments not yet compacted and removed, by name
+        self._active = None
+        self._app = None
+        self.path = None
+        atexit.register(self.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        """A forked worker starts without the parent's segments, locks and compactor thread."""
+        for segment in self._segments.values():
+            segment.close()  # the parent still holds the file and its flock
+        self._segments = {}
+        self._active = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def configure(self, path=None, segment_records=65536, compact_interval_ms=1000, app=None):
+        self.stop()
+        self.path = path
+        self.segment_records = segment_records
+        self.compact_interval = compact_interval_ms / 1000.0
+        self._app = app
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def _open_segment(self):
+        name = f'{time.time_ns() // 1000:017d}-{os.getpid()}.seg'
+        segment = Segment(os.path.join(self.path, name), self.segment_records)
+        segment.lock()
+        self._segments[name] = segment
+        self._active = segment
+        return segment
+
+    def append(self, user_id, access_granted, method, error_log=None):
+        """Journal one event; False when it cannot be journaled (disabled or free-form message)."""
+        if not self.enabled:
+            return False
+        code = error_code(error_log)
+        if code is None:
+            return False
+
+        timestamp = time.time_ns() // 1000
+        with self._lock:
+            segment = self._active
+            if segment is None or segment.full:
+                segment = self._open_segment()
+            segment.append(timestamp, user_id, bool(access_granted), method or 0, code)
+        if self._thread is None:
+            self.start()
+        return True
+
+    def start(self):
+        with self._lock:
+            if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='access-journal', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the compactor, load everything still journaled and remove own segments."""
+        thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._stop.set()
+            thread.join()
+        if self.enabled and self._segments:
+            with self._lock:
+                self._active = None
+            self.compact()
+
+    def _run(self):
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception:
+                logger.exception('Compacting the access journal failed')
+
+    def compact(self):
+        """Load new records of every segment into the Log table; returns the number of rows."""
+        if not self.enabled:
+            return 0
+        with self._compact_lock:
+            if self._app is not None:
+                with self._app.app_context():
+                    try:
+                        return self._compact()
+                    finally:
+                        db.session.remove()
+            return self._compact()
+
+    def _compact(self):
+        checkpoints = dict(db.session.query(JournalCheckpoint.segment, JournalCheckpoint.compacted).all())
+        loaded = 0
+        for path in sorted(glob.glob(os.path.join(self.path, '*.seg'))):
+            name = os.path.basename(path)
+            with self._lock:
+                segment = self._segments.get(name)
+                own = segment is not None
+                count = segment.count if own else None
+                active = segment is self._active
+
+            if not own:
+                try:
+                    segment = Segment(path)
+                except (OSError, ValueError):
+                    continue
+                # Without flock the owner cannot be detected; only startup replays other files
+                if not segment.lock(blocking=False) or (fcntl is None and self._thread is not None):
+                    segment.close()
+                    continue
+                if not os.path.exists(path):  # another process replayed it while we waited
+                    segment.close()
+                    continue
+                count = segment.count
+                checkpoints[name] = db.session.query(JournalCheckpoint.compacted).filter_by(
+                    segment=name).scalar() or 0
+
+            done = checkpoints.get(name, 0)
+            if count > done:
+                self._load(segment, name, done, count)
+                loaded += count - done
+
+            # Own segments are done once rotated out (or on shutdown), others once replayed
+            if not own or not active:
+                segment.remove()
+                db.session.execute(delete(JournalCheckpoint).where(JournalCheckpoint.segment == name))
+                db.session.commit()
+                with self._lock:
+                    self._segments.pop(name, None)
+            else:
+                segment.flush()
+        return loaded
+
+    def _load(self, segment, name, start, stop):
+        records = segment.read(start, stop)
+        created = records['timestamp'].astype('datetime64[us]').tolist()
+        rows = [
+            {
+                'user_id': int(record['user_id']),
+                'access_granted': bool(record['granted']),
+                'method': int(record['method']),
+                'error_log': ERROR_MESSAGES.get(int(record['error'])),
+                'created_at': created_at,
+            }
+            for record, created_at in zip(records, created)
+        ]
+        db.session.execute(insert(Log), rows)
+        update_rollups(db.session, rows)
+        db.session.merge(JournalCheckpoint(segment=name, compacted=stop))
+        db.session.commit()
+
+
+access_journal = AccessJournal()
+
+
+def default_journal_path(app):
+    """Keep the journal next to the SQLite file, else in the instance folder."""
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite':
+        if not url.database or url.database == ':memory:':
+            return None
+        return os.path.splitext(url.database)[0] + '.journal'
+    return os.path.join(app.instance_path, 'journal')
+
+
+def configure_access_journal(app):
+    """Replay segments left by crashed processes, then journal; the compactor starts with the first event."""
+    if not app.config.get('LOG_JOURNAL', True):
+        access_journal.configure(None)
+        return
+    with app.app_context():
+        path = app.config.get('LOG_JOURNAL_PATH') or default_journal_path(app)
+    access_journal.configure(
+        path=path,
+        segment_records=app.config.get('LOG_JOURNAL_SEGMENT_RECORDS', 65536),
+        compact_interval_ms=app.config.get('LOG_JOURNAL_COMPACT_MS', 1000),
+        app=app,
+    )
+    access_journal.compact()
@@ -0,0 +1,154 @@
+import os
+import shutil
+
+import numpy as np
+
+
+def top_k(sims, ids, k):
+    """Pick the k best (id, similarity) pairs without a full sort."""
+    k = min(k, len(sims))
+    if k <= 0:
+        return []
+    top = np.argpartition(-sims, k - 1)[:k]
+    top = top[np.argsort(-sims[top])]
+    return [(int(ids[i]), float(sims[i])) for i in top]
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index in pure NumPy.
+
+    Vectors are clustered around ``nlist`` centroids (spherical k-means) and
+    stored contiguously per cluster. A query scores the centroids first and
+    then only the ``nprobe`` closest clusters, which trades a little recall
+    for touching roughly ``nprobe / nlist`` of the gallery.
+    """
+
+    FILES = ('centroids', 'offsets', 'ids', 'vectors')
+
+    def __init__(self, nlist=None, nprobe=32, train_iters=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.seed = seed
+        self.centroids = None
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def train(self, vectors):
+        """Fit centroids on (a sample of) L2-normalized vectors."""
+        n = len(vectors)
+        nlist = self.nlist or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(self.seed)
+
+        # ~40 points per centroid is enough to place it and keeps training short
+        sample_size = min(n, nlist * 40)
+        sample = vectors[rng.choice(n, sample_size, replace=False)] if sample_size < n else vectors
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(self.train_iters):
+            assign = self._assign(sample, centroids)
+            order = np.argsort(assign, kind='stable')
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+
+            sums = np.zeros_like(centroids)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums[~empty] = np.add.reduceat(sample[order], starts[~empty], axis=0)
+
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+
+        self.centroids = centroids.astype(np.float32)
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk=65536):
+        assign = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk):
+            block = vectors[start:start + chunk] @ centroids.T
+            assign[start:start + chunk] = np.argmax(block, axis=1)
+        return assign
+
+    def build(self, ids, vectors, retrain=True):
+        """
+        Index ``vectors`` (already L2-normalized float32) under ``ids``.
+
+        With ``retrain=False`` the existing centroids are reused, which makes
+        a rebuild a single assignment pass instead of a k-means run.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(ids) == 0:
+            self.centroids = np.empty((0, vectors.shape[1]), dtype=np.float32)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.ids = ids
+            self.vectors = vectors
+            return
+
+        if retrain or self.centroids is None or len(self.centroids) == 0:
+            self.train(vectors)
+
+        assign = self._assign(vectors, self.centroids)
+        order = np.argsort(assign, kind='stable')
+        counts = np.bincount(assign, minlength=len(self.centroids))
+        self.offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.ids = ids[order]
+        self.vectors = vectors[order]
+
+    def search(self, vec, k=1, exclude=None):
+        """Return up to k (id, similarity) pairs from the probed clusters."""
+        if len(self.ids) == 0:
+            return []
+
+        coarse = self.centroids @ vec
+        nprobe = min(self.nprobe, len(coarse))
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        sims, ids = [], []
+        for cluster in probe:
+            lo, hi = self.offsets[cluster], self.offsets[cluster + 1]
+            if hi > lo:
+                sims.append(self.vectors[lo:hi] @ vec)
+                ids.append(self.ids[lo:hi])
+        if not sims:
+            return []
+        sims = np.concatenate(sims)
+        ids = np.concatenate(ids)
+
+        if exclude:
+            keep = ~np.isin(ids, np.fromiter(exclude, dtype=np.int64))
+            sims, ids = sims[keep], ids[keep]
+
+        return top_k(sims, ids, k)
+
+    def save(self, path):
+        """Write the index as .npy files, swapping the directory in atomically."""
+        tmp = path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in self.FILES:
+            np.save(os.path.join(tmp, name + '.npy'), getattr(self, name))
+
+        old = path + '.old'
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.isdir(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def load(self, path):
+        """Memory-map a saved index. Returns False if nothing usable is on disk."""
+        files = [os.path.join(path, name + '.npy') for name in self.FILES]
+        if not all(os.path.exists(f) for f in files):
+            return False
+        arrays = [np.load(f, mmap_mode='r') for f in files]
+        self.centroids, self.offsets, self.ids, self.vectors = arrays
+        self.nlist = len(self.centroids)
+        return True
@@ -0,0 +1,271 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import zipfile
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+from sqlalchemy import delete, insert, select, update
+
+from models import db, User, FaceTemplate, EnrollmentJob
+from utils.embeddingCodec import encode, decode, centroid, format_code, FORMAT_FLOAT32
+from utils.faceIndex import face_index
+from utils.faceRecognition import detect_faces, align_face, embed_faces
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Keeps IN (...) lists below SQLite's bound-parameter limit
+CHUNK = 500
+
+_archive = None
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def list_photos(source):
+    """Return the <email>.jpg entries of a directory or zip archive as (name, email)."""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = [name for name in archive.namelist() if not name.endswith('/')]
+    else:
+        names = sorted(
+            os.path.relpath(os.path.join(root, name), source)
+            for root, _, files in os.walk(source) for name in files
+        )
+
+    photos = []
+    for name in names:
+        stem, ext = os.path.splitext(os.path.basename(name))
+        if ext.lower() in IMAGE_EXTENSIONS and not stem.startswith('.'):
+            photos.append((name, stem))
+    return photos
+
+
+def _init_worker(source):
+    """Open the archive once per worker process instead of once per photo."""
+    global _archive
+    _archive = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else source
+
+
+def read_photo(name):
+    """Read and decode one photo inside a worker process; None if it is not an image."""
+    try:
+        if isinstance(_archive, zipfile.ZipFile):
+            data = _archive.read(name)
+        else:
+            with open(os.path.join(_archive, name), 'rb') as f:
+                data = f.read()
+    except (OSError, zipfile.BadZipFile):
+        return None
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def save_templates(embeddings, fmt=FORMAT_FLOAT32, max_templates=5):
+    """
+    Store new templates for many users in a single transaction.
+
+    ``embeddings`` maps user_id -> list of embeddings. Templates beyond the
+    cap are pruned and every touched user's centroid is refreshed with
+    bulk statements. Returns user_id -> kept template matrix.
+    """
+    now = datetime.utcnow()
+    db.session.execute(insert(FaceTemplate), [
+        {'user_id': user_id, 'embedding': encode(embedding, fmt), 'embedding_format': fmt, 'created_at': now}
+        for user_id, user_embeddings in embeddings.items()
+        for embedding in user_embeddings
+    ])
+
+    kept, stale = defaultdict(list), []
+    for chunk in _chunks(list(embeddings), CHUNK):
+        rows = db.session.execute(
+            select(FaceTemplate.id, FaceTemplate.user_id, FaceTemplate.embedding_format, FaceTemplate.embedding)
+            .where(FaceTemplate.user_id.in_(chunk))
+            .order_by(FaceTemplate.user_id, FaceTemplate.id.desc())
+        ).all()
+        for row in rows:
+            if len(kept[row.user_id]) < max_templates:
+                kept[row.user_id].append(decode(row.embedding, row.embedding_format))
+            else:
+                stale.append(row.id)
+
+    for chunk in _chunks(stale, CHUNK):
+        db.session.execute(delete(FaceTemplate).where(FaceTemplate.id.in_(chunk)))
+
+    templates = {user_id: np.stack(rows) for user_id, rows in kept.items()}
+    db.session.execute(update(User), [
+        {'id': user_id, 'biometric_blob': encode(centroid(matrix), fmt), 'biometric_format': fmt}
+        for user_id, matrix in templates.items()
+    ])
+    db.session.commit()
+    return templates
+
+
+def enroll_photos(source, workers=None, batch_size=64, window=256, fmt=FORMAT_FLOAT32, max_templates=5):
+    """
+    Enroll every <email>.jpg found in a directory or zip archive.
+
+    Photos are decoded in a process pool while the previous window goes
+    through detection; recognition runs ``batch_size`` crops per ONNX call
+    and all templates are written in one transaction at the end. Returns a
+    report with a result entry for every file.
+    """
+    photos = list_photos(source)
+    results = []
+
+    users = {}
+    emails = sorted({email for _, email in photos})
+    for chunk in _chunks(emails, CHUNK):
+        users.update(db.session.execute(
+            select(User.email, User.id).where(User.email.in_(chunk))
+        ).all())
+
+    known = []
+    for name, email in photos:
+        if email in users:
+            known.append((name, email))
+        else:
+            results.append({'file': name, 'email': email, 'status': 'failed', 'error': 'unknown_user'})
+
+    crops, owners = [], []
+    embeddings = defaultdict(list)
+
+    def flush():
+        if crops:
+            for (name, email), embedding in zip(owners, embed_faces(crops)):
+                embeddings[users[email]].append(embedding)
+                results.append({'file': name, 'email': email, 'status': 'enrolled'})
+            crops.clear()
+            owners.clear()
+
+    windows = list(_chunks(known, window))
+    # Spawned, not forked: the server forks from a process whose threads (inference, log writer,
+    # sweepers) may hold locks the children would inherit locked
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(source,),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = [pool.submit(read_photo, name) for name, _ in windows[0]] if windows else []
+        for index, current in enumerate(windows):
+            images = [future.result() for future in pending]
+            # Decode the next window while this one is being detected
+            pending = [pool.submit(read_photo, name) for name, _ in windows[index + 1]] \
+                if index + 1 < len(windows) else []
+
+            for (name, email), image in zip(current, images):
+                if image is None:
+                    results.append({'file': name, 'email': email, 'status': 'failed', 'error': 'bad_image'})
+                    continue
+                bboxes, kpss = detect_faces(image)
+                if len(bboxes) != 1:
+                    error = 'no_face' if len(bboxes) == 0 else 'multiple_faces'
+                    results.append({'file': name, 'email': email, 'status': 'failed', 'error': error})
+                    continue
+                crops.append(align_face(image, kpss[0]))
+                owners.append((name, email))
+                if len(crops) >= batch_size:
+                    flush()
+        flush()
+
+    if embeddings:
+        templates = save_templates(embeddings, fmt, max_templates)
+        face_index.add_many(
+            (user_id, matrix if face_index.use_templates else centroid(matrix))
+            for user_id, matrix in templates.items()
+        )
+
+    failures = Counter(result['error'] for result in results if result['status'] == 'failed')
+    return {
+        'total': len(photos),
+        'enrolled': len(photos) - sum(failures.values()),
+        'failed': sum(failures.values()),
+        'failures': dict(failures),
+        'results': results,
+    }
+
+
+class EnrollmentJobs:
+    """
+    Bulk enrollments queued by POST /users/photos/bulk, run one at a time
+    on a background thread of the process that received the archive.
+
+    Jobs and their reports are kept in enrollment_jobs, so any worker can
+    answer the status URL. At most ``max_queued`` archives wait; beyond
+    that submit() raises queue.Full (the caller answers 503).
+    """
+
+    def __init__(self, max_queued=4):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self.configure(max_queued)
+
+    def configure(self, max_queued=4, app=None):
+        self._app = app
+        self._queue = queue.Queue(maxsize=max(1, max_queued))
+
+    def submit(self, path):
+        """Queue the archive at ``path`` (removed once processed) and return the job id."""
+        with self._lock:
+            # Only submit() adds, so the queue cannot fill up between this check and the put
+            if self._queue.full():
+                raise queue.Full('bulk enrollment queue full')
+            job = EnrollmentJob(status='queued')
+            db.session.add(job)
+            db.session.commit()
+            self._queue.put_nowait((job.id, path))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='bulk-enroll', daemon=True)
+                self._thread.start()
+        return job.id
+
+    def _run(self):
+        while True:
+            job_id, path = self._queue.get()
+            with self._app.app_context():
+                try:
+                    self._process(job_id, path)
+                except Exception:
+                    logger.exception('Bulk enrollment job %s failed', job_id)
+                finally:
+                    db.session.remove()
+                    os.remove(path)
+
+    def _process(self, job_id, path):
+        job = db.session.get(EnrollmentJob, job_id)
+        job.status, job.started_at = 'running', datetime.utcnow()
+        db.session.commit()
+
+        config = self._app.config
+        try:
+            report = enroll_photos(
+                path,
+                workers=config.get('FACE_BULK_WORKERS'),
+                batch_size=config.get('FACE_BULK_BATCH_SIZE', 64),
+                fmt=format_code(config.get('FACE_EMBEDDING_FORMAT', 'float32')),
+                max_templates=config.get('FACE_MAX_TEMPLATES', 5),
+            )
+        except Exception as e:
+            db.session.rollback()
+            logger.exception('Bulk enrollment job %s failed', job_id)
+            job = db.session.get(EnrollmentJob, job_id)
+            job.status, job.error = 'failed', str(e)
+        else:
+            job.status, job.report = 'done', json.dumps(report)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+enrollment_jobs = EnrollmentJobs()
+
+
+def configure_enrollment_jobs(app):
+    enrollment_jobs.configure(max_queued=app.config.get('FACE_BULK_QUEUE', 4), app=app)
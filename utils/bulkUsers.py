@@ -0,0 +1,162 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, or_, select, update
+
+from models import db, User
+from utils.expirySweeper import expired_users
+from utils.passwordHasher import password_hasher
+from utils.qrCode import first_token_versions, generate_secure_token, revocations
+
+DEFAULT_DAYS = 100
+DEFAULT_PASSWORD = 'haslo'
+
+
+def _report(results, success):
+    failures = Counter(result['error'] for result in results if result['status'] == 'failed')
+    return {
+        'total': len(results),
+        success: len(results) - sum(failures.values()),
+        'failed': sum(failures.values()),
+        'failures': dict(failures),
+        'results': results,
+    }
+
+
+def _validate(items, default_days):
+    """Split requested users into insertable rows and per-item failures, keeping request order."""
+    results, rows, seen = [], [], set()
+    for item in items:
+        email = (item.get('email') or '').strip() if isinstance(item, dict) else ''
+        result = {'email': email or None}
+        results.append(result)
+        if not email:
+            result.update(status='failed', error='email_required')
+            continue
+        if email in seen:
+            result.update(status='failed', error='duplicate_in_request')
+            continue
+        seen.add(email)
+        try:
+            days = int(item.get('days') or default_days)
+        except (TypeError, ValueError):
+            result.update(status='failed', error='invalid_days')
+            continue
+        password = item.get('password') or DEFAULT_PASSWORD
+        if not isinstance(password, str):
+            result.update(status='failed', error='invalid_password')
+            continue
+        rows.append((result, email, password, days))
+    return results, rows
+
+
+def create_users(items, default_days=DEFAULT_DAYS):
+    """
+    Create many users in one transaction, as POST /auth/create does for one.
+
+    Existing emails are found with a single IN query, the passwords are
+    hashed in parallel on the password hashing pool and the users are
+    inserted with one multi-row INSERT ... RETURNING. Their QR tokens need
+    the new ids (and the token version a reused id starts at), so they are
+    signed afterwards and written with one executemany UPDATE. Returns a report with a result per requested user.
+    Raises queue.Full when the password hashing pool is saturated.
+    """
+    results, rows = _validate(items, default_days)
+
+    emails = [email for _, email, _, _ in rows]
+    existing = set(db.session.execute(select(User.email).where(User.email.in_(emails))).scalars()) if emails else set()
+    pending = []
+    for row in rows:
+        if row[1] in existing:
+            row[0].update(status='failed', error='email_exists')
+        else:
+            pending.append(row)
+
+    if pending:
+        hashes = password_hasher.hash_many([password for _, _, password, _ in pending])
+        now = datetime.now()
+        # RETURNING rows are matched by email: asking for parameter order makes SQLite insert row by row
+        created = db.session.execute(
+            insert(User).returning(User.id, User.email, User.expire_time, User.token_version),
+            [
+                {'email': email, 'password_hash': password_hash, 'expire_time': now + timedelta(days=days),
+                 'token_version': 0, 'is_admin': False, 'created_at': now}
+                for (_, email, _, days), password_hash in zip(pending, hashes)
+            ],
+        ).all()
+        versions = first_token_versions([user.id for user in created])
+        created = {
+            user.email: (user, versions.get(user.id, 0), generate_secure_token(user, versions.get(user.id, 0)))
+            for user in created
+        }
+
+        db.session.execute(update(User), [
+            {'id': user.id, 'token_version': version, 'qr_token': token} for user, version, token in created.values()
+        ])
+        db.session.commit()
+
+        for result, email, _, _ in pending:
+            user, _, token = created[email]
+            result.update(status='created', id=user.id, expire_time=user.expire_time.isoformat(), qr_token=token)
+
+    return _report(results, 'created')
+
+
+def _plus_days(column, days):
+    """``column + days`` evaluated by the database."""
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite keeps datetimes as text and compares them as text, so the result has to
+        # match SQLAlchemy's microsecond format; strftime's %f stops at milliseconds
+        return func.strftime('%Y-%m-%d %H:%M:%f', column, f'{days:+d} days').concat('000')
+    return column + timedelta(days=days)
+
+
+def extend_expiry(days, user_ids=None, emails=None, email_prefix=None, expired=None):
+    """
+    Move expire_time of every matching user ``days`` days forward with one UPDATE.
+
+    Users are selected by ids or emails, narrowed down by an email prefix
+    and/or their expired state. Users without an expiry, or expired
+    ones, are extended from now. The expiry is signed into QR tokens, so
+    token_version is bumped in the same UPDATE and the new tokens are
+    written and the old ones revoked in bulk afterwards. Each requested id
+    or email that matched nothing is reported as not_found.
+    """
+    now = datetime.now()
+    filters = []
+    if user_ids or emails:
+        filters.append(or_(User.id.in_(user_ids or []), User.email.in_(emails or [])))
+    if email_prefix:
+        filters.append(User.email.startswith(email_prefix, autoescape=True))
+    if expired is not None:
+        filters.append(User.expire_time < now if expired else
+                       (User.expire_time >= now) | User.expire_time.is_(None))
+
+    start = func.max(func.coalesce(User.expire_time, now), now) if db.engine.dialect.name == 'sqlite' \
+        else func.greatest(func.coalesce(User.expire_time, now), now)
+    updated = db.session.execute(
+        update(User)
+        .where(*filters)
+        .values(expire_time=_plus_days(start, days), token_version=func.coalesce(User.token_version, 0) + 1)
+        .returning(User.id, User.email, User.expire_time, User.token_version)
+    ).all()
+
+    tokens = [{'id': user.id, 'qr_token': generate_secure_token(user)} for user in updated]
+    if tokens:
+        db.session.execute(update(User), tokens)
+    revocations.revoke_many({user.id: user.token_version for user in updated})
+    db.session.commit()
+    expired_users.discard(user.id for user in updated if user.expire_time > now)
+
+    results = [
+        {'id': user.id, 'email': user.email, 'status': 'updated',
+         'expire_time': user.expire_time.isoformat(), 'qr_token': token['qr_token']}
+        for user, token in zip(updated, tokens)
+    ]
+    found_ids = {user.id for user in updated}
+    found_emails = {user.email for user in updated}
+    results += [{'id': user_id, 'status': 'failed', 'error': 'not_found'}
+                for user_id in user_ids or () if user_id not in found_ids]
+    results += [{'email': email, 'status': 'failed', 'error': 'not_found'}
+                for email in emails or () if email not in found_emails]
+    return _report(results, 'updated')
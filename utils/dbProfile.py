@@ -0,0 +1,26 @@
+from sqlalchemy import event
+
+from models import db
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run ``PRAGMA name=value`` for every new connection of a SQLite ``engine``."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return False
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+    return True
+
+
+def configure_database(app):
+    """Apply SQLITE_PRAGMAS; must run before the first connection is opened."""
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, app.config.get('SQLITE_PRAGMAS'))
@@ -0,0 +1,72 @@
+import numpy as np
+
+EMBEDDING_DIM = 512
+
+# Storage formats, kept in User.biometric_format next to the blob.
+# The codes are persisted, so never renumber them.
+FORMAT_FLOAT32 = 1
+FORMAT_FLOAT16 = 2
+FORMAT_INT8 = 3
+
+FORMATS = {
+    'float32': FORMAT_FLOAT32,
+    'float16': FORMAT_FLOAT16,
+    'int8': FORMAT_INT8,
+}
+
+DTYPES = {
+    FORMAT_FLOAT32: np.dtype('<f4'),
+    FORMAT_FLOAT16: np.dtype('<f2'),
+    FORMAT_INT8: np.dtype('i1'),
+}
+
+
+def encode(embedding, fmt=FORMAT_FLOAT32):
+    """
+    Pack an embedding into bytes.
+
+    int8 scales each vector so its largest component maps to 127. Matching
+    only uses cosine similarity, so the scale itself is not stored.
+    """
+    vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    if fmt == FORMAT_INT8:
+        peak = float(np.abs(vec).max()) or 1.0
+        vec = np.round(vec * (127.0 / peak))
+    return vec.astype(DTYPES[fmt]).tobytes()
+
+
+def decode(blob, fmt):
+    """Unpack one stored embedding as float32."""
+    if blob is None:
+        return None
+    return np.frombuffer(blob, dtype=DTYPES[fmt]).astype(np.float32)
+
+
+def decode_column(blobs, fmt, dim=EMBEDDING_DIM):
+    """
+    Turn many blobs of the same format into one (n, dim) float32 matrix
+    with a single frombuffer call.
+    """
+    if not blobs:
+        return np.empty((0, dim), dtype=np.float32)
+    return np.frombuffer(b''.join(blobs), dtype=DTYPES[fmt]).reshape(-1, dim).astype(np.float32)
+
+
+def normalize_rows(matrix):
+    """L2-normalize every row of a (n, dim) matrix."""
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def centroid(templates):
+    """Normalized mean direction of several templates of the same face."""
+    mean = normalize_rows(templates).mean(axis=0)
+    return mean / max(float(np.linalg.norm(mean)), 1e-12)
+
+
+def format_code(name):
+    """Map a config name ('float32', 'float16', 'int8') to its stored code."""
+    try:
+        return FORMATS[name]
+    except KeyError:
+        raise ValueError(f'Unknown embedding format {name!r}, expected one of {", ".join(FORMATS)}')
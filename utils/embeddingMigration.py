@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from sqlalchemy import exists, insert, literal, select, update
+
+from models import db, User, FaceTemplate
+from utils.embeddingCodec import encode, EMBEDDING_DIM
+from utils.schema import add_missing_columns
+
+
+def ensure_biometric_columns():
+    """Add the binary embedding columns to a users table created before they existed."""
+    add_missing_columns('users', {
+        'biometric_blob': db.LargeBinary(),
+        'biometric_format': db.SmallInteger(),
+    })
+
+
+def migrate_biometric_json(fmt, after_id=0, batch_size=500):
+    """
+    Convert one batch of legacy JSON-list embeddings into binary blobs.
+
+    Rows are walked by primary key so values that are not a valid embedding
+    (e.g. old SHA-256 strings) are skipped instead of being retried forever.
+    Returns (last id of the batch, rows read), the id being None when no
+    row is left; the caller commits.
+    """
+    rows = db.session.execute(
+        select(User.id, User.biometric_hash)
+        .where(User.id > after_id, User.biometric_blob.is_(None), User.biometric_hash.isnot(None))
+        .order_by(User.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return None, 0
+
+    params = [
+        {'id': row.id, 'biometric_blob': encode(row.biometric_hash, fmt),
+         'biometric_format': fmt, 'biometric_hash': None}
+        for row in rows
+        if isinstance(row.biometric_hash, list) and len(row.biometric_hash) == EMBEDDING_DIM
+    ]
+    if params:
+        db.session.execute(update(User), params)
+    return rows[-1].id, len(rows)
+
+
+def migrate_user_templates(after_id=0, batch_size=500):
+    """
+    Give one batch of users enrolled before face templates existed their
+    embedding as first template. Same return value as migrate_biometric_json().
+    """
+    has_template = exists().where(FaceTemplate.user_id == User.id)
+    user_ids = db.session.execute(
+        select(User.id)
+        .where(User.id > after_id, User.biometric_blob.isnot(None), ~has_template)
+        .order_by(User.id)
+        .limit(batch_size)
+    ).scalars().all()
+    if not user_ids:
+        return None, 0
+
+    legacy = select(
+        User.id, User.biometric_blob, User.biometric_format, literal(datetime.utcnow())
+    ).where(User.id.in_(user_ids))
+    db.session.execute(
+        insert(FaceTemplate).from_select(['user_id', 'embedding', 'embedding_format', 'created_at'], legacy)
+    )
+    return user_ids[-1], len(user_ids)
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func, or_, select
+
+from models import db, User, QRRevocation
+from utils.pagination import after
+from utils.qrCode import revocations
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiredUsers:
+    """
+    In-process set of expired user ids, for access paths that never load
+    the user (1:N face identification).
+
+    Rebuilt from the expire_time index by the sweeper; this worker's own
+    expiry extensions are applied at once with discard(). Admins are left
+    out, as they can still log in after their expiry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = frozenset()
+
+    def __contains__(self, user_id):
+        return user_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load_from_db(self, now=None):
+        ids = db.session.execute(
+            select(User.id).where(User.expire_time <= (now or datetime.now()), User.is_admin.is_(False))
+        ).scalars()
+        with self._lock:
+            self._ids = frozenset(ids)
+
+    def add(self, user_ids):
+        with self._lock:
+            self._ids = self._ids | frozenset(user_ids)
+
+    def discard(self, user_ids):
+        with self._lock:
+            self._ids = self._ids - frozenset(user_ids)
+
+
+expired_users = ExpiredUsers()
+
+
+def sweep_expired(until, since=None, batch_size=1000):
+    """
+    Revoke the QR tokens of users whose expiry passed in (since, until].
+
+    Users are walked along the expire_time index in (expire_time, id)
+    order, one short transaction per batch. Revocations go through
+    qr_revocations, so every worker's revocation list picks them up;
+    users already revoked at their current token version are skipped, so
+    a sweep that runs again writes nothing. Returns the number of users
+    revoked.
+    """
+    not_revoked = or_(QRRevocation.min_version.is_(None),
+                      QRRevocation.min_version <= func.coalesce(User.token_version, 0))
+    filters = [User.expire_time <= until, User.is_admin.is_(False), not_revoked]
+    if since is not None:
+        filters.append(User.expire_time > since)
+
+    swept = 0
+    key = None
+    while True:
+        statement = select(User.id, User.expire_time, User.token_version) \
+            .outerjoin(QRRevocation, QRRevocation.user_id == User.id).where(*filters)
+        if key is not None:
+            statement = statement.where(after((User.expire_time, User.id), key, descending=False))
+        rows = db.session.execute(statement.order_by(User.expire_time, User.id).limit(batch_size)).all()
+        if not rows:
+            return swept
+
+        # An extension rotates the token to token_version + 1, which this still accepts
+        revocations.revoke_many({row.id: (row.token_version or 0) + 1 for row in rows})
+        db.session.commit()
+        expired_users.add(row.id for row in rows)
+
+        swept += len(rows)
+        key = (rows[-1].expire_time, rows[-1].id)
+        if len(rows) < batch_size:
+            return swept
+
+
+def start_sweeper(app, interval):
+    """Sweep newly expired users every ``interval`` seconds and rebuild expired_users."""
+    def run():
+        since = None  # the first pass also catches users that expired while no worker ran
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    now = datetime.now()
+                    swept = sweep_expired(now, since, batch_size=app.config.get('USER_EXPIRY_SWEEP_BATCH', 1000))
+                    # Also drops users whose expiry another worker extended
+                    expired_users.load_from_db(now)
+                    since = now
+                    if swept:
+                        logger.info('Revoked %d expired users', swept)
+                except Exception:
+                    logger.exception('Sweeping expired users failed')
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name='expiry-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+
+def configure_expiry_sweeper(app):
+    with app.app_context():
+        expired_users.load_from_db()
+    if app.config.get('USER_EXPIRY_SWEEP_INTERVAL', 0) > 0:
+        start_sweeper(app, app.config['USER_EXPIRY_SWEEP_INTERVAL'])
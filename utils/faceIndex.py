@@ -0,0 +1,353 @@
+import logging
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import func
+
+from models import db, User, FaceTemplate
+from utils.annIndex import IVFIndex, top_k
+from utils.embeddingCodec import decode_column
+
+logger = logging.getLogger(__name__)
+
+
+class FaceIndex:
+    """
+    In-memory 1:N identification index over enrolled face embeddings.
+
+    Every embedding is L2-normalized once and packed into a single float32
+    matrix, so identifying a probe is one matrix-vector product plus a
+    top-k selection instead of a per-user database lookup.
+
+    With an ANN ``backend`` (see utils/annIndex.py) the backend holds the
+    bulk of the gallery and the exact matrix only carries rows enrolled
+    since the backend was built. Backend rows of re-enrolled or deleted
+    users are masked out until the next rebuild folds the changes in.
+
+    A user may own several rows (one per face template). Lookups rank
+    users by their best template ('max') or by the average over their
+    templates ('mean'); with ``use_templates=False`` the gallery holds one
+    centroid row per user instead.
+    """
+
+    def __init__(self, dim=512, backend=None, path=None, rebuild_threshold=1024,
+                 use_templates=False, max_templates=1):
+        self.dim = dim
+        self._lock = threading.RLock()
+        self.configure(backend, path, rebuild_threshold, use_templates, max_templates)
+
+    def configure(self, backend=None, path=None, rebuild_threshold=1024,
+                  use_templates=False, max_templates=1):
+        with self._lock:
+            self.backend = backend
+            self.path = path
+            self.rebuild_threshold = rebuild_threshold
+            self.use_templates = use_templates
+            self.max_templates = max(1, max_templates) if use_templates else 1
+            self._tombstones = set()  # user ids whose backend rows are stale
+            self._set_exact(np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32))
+            self._loaded = False
+
+    def __len__(self):
+        size = self._size
+        if self.backend is not None:
+            stale = np.isin(self.backend.ids, np.fromiter(self._tombstones, dtype=np.int64))
+            size += len(self.backend) - int(np.count_nonzero(stale))
+        return size
+
+    def _normalize(self, embeddings):
+        """Normalize one embedding or a (n, dim) matrix; drops unusable rows."""
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.size == 0 or matrix.shape[-1] != self.dim:
+            return None
+        matrix = matrix.reshape(-1, self.dim)
+        norms = np.linalg.norm(matrix, axis=1)
+        valid = np.isfinite(norms) & (norms > 0)
+        if not valid.any():
+            return None
+        return matrix[valid] / norms[valid, None]
+
+    def _reserve(self, size):
+        """Grow the backing arrays geometrically so appends stay amortized O(1)."""
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2, 64)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        ids = np.empty(capacity, dtype=np.int64)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+
+    def _set_exact(self, ids, vectors):
+        self._matrix = np.empty((0, self.dim), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._reserve(len(ids))
+        self._matrix[:len(ids)] = vectors
+        self._ids[:len(ids)] = ids
+        self._size = len(ids)
+        self._rows = defaultdict(list)  # user_id -> rows in _matrix
+        for row, user_id in enumerate(ids):
+            self._rows[int(user_id)].append(row)
+
+    def load(self, entries):
+        """Replace the index content with (user_id, embedding) pairs."""
+        ids, vectors = [], []
+        for user_id, embedding in entries:
+            if embedding is None:
+                continue
+            vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+            if vec.shape[0] == self.dim:
+                ids.append(int(user_id))
+                vectors.append(vec)
+        self.load_matrix(ids, np.stack(vectors) if vectors else np.empty((0, self.dim), dtype=np.float32))
+
+    def load_matrix(self, ids, matrix):
+        """Replace the index content with an (n, dim) embedding matrix, normalized in one pass."""
+        ids = np.asarray(ids, dtype=np.int64)
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(matrix, axis=1)
+        valid = np.isfinite(norms) & (norms > 0)
+        ids = ids[valid]
+        vectors = matrix[valid] / norms[valid, None]
+
+        with self._lock:
+            if self.backend is not None:
+                self.backend.build(ids, vectors)
+                self._tombstones = set()
+                self._set_exact(ids[:0], vectors[:0])
+                self._save(full=True)
+            else:
+                self._set_exact(ids, vectors)
+            self._loaded = True
+
+    def load_from_db(self):
+        """Build the index from the templates (or user centroids) with a single column query."""
+        if self.use_templates:
+            rows = db.session.query(
+                FaceTemplate.user_id, FaceTemplate.embedding_format, FaceTemplate.embedding
+            ).all()
+        else:
+            rows = db.session.query(User.id, User.biometric_format, User.biometric_blob).filter(
+                User.biometric_blob.isnot(None)
+            ).all()
+
+        # One frombuffer per storage format instead of decoding row by row
+        groups = defaultdict(lambda: ([], []))
+        for user_id, fmt, blob in rows:
+            groups[fmt][0].append(user_id)
+            groups[fmt][1].append(blob)
+        ids = [user_id for fmt in groups for user_id in groups[fmt][0]]
+        matrix = [decode_column(blobs, fmt, self.dim) for fmt, (_, blobs) in groups.items()]
+        self.load_matrix(ids, np.concatenate(matrix) if matrix else np.empty((0, self.dim), dtype=np.float32))
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load_from_db()
+
+    @staticmethod
+    def _source_fingerprint():
+        """Count, max and sum of the enrolled template and user ids, which change with every enrollment."""
+        templates = db.session.query(
+            func.count(FaceTemplate.id), func.max(FaceTemplate.id), func.sum(FaceTemplate.id)
+        ).one()
+        users = db.session.query(func.count(User.id), func.max(User.id), func.sum(User.id)).filter(
+            User.biometric_blob.isnot(None)
+        ).one()
+        return np.array([value or 0 for value in (*templates, *users)], dtype=np.int64)
+
+    def restore(self):
+        """
+        Reload a persisted backend and its pending changes from ``path``.
+
+        Enrollments and deletions made while no process saved the index
+        (a crash, another deployment, a restored database) would stay
+        invisible, so the snapshot is only used when the fingerprint saved
+        with it still matches the database. Otherwise the index is rebuilt
+        from the database on first use.
+        """
+        if self.backend is None or not self.path:
+            return False
+        with self._lock:
+            try:
+                source = np.load(os.path.join(self.path, 'source.npy'))
+            except (FileNotFoundError, ValueError):
+                source = None
+            if source is None or not np.array_equal(source, self._source_fingerprint()):
+                logger.info('Persisted face index at %s is out of date, rebuilding it', self.path)
+                return False
+            if not self.backend.load(self.path):
+                return False
+            try:
+                ids = np.load(os.path.join(self.path, 'delta_ids.npy'))
+                vectors = np.load(os.path.join(self.path, 'delta_vectors.npy'))
+                tombstones = np.load(os.path.join(self.path, 'tombstones.npy'))
+            except FileNotFoundError:
+                ids, vectors, tombstones = np.empty(0, dtype=np.int64), None, []
+            if len(ids):
+                self._set_exact(ids, vectors)
+            self._tombstones = {int(user_id) for user_id in tombstones}
+            self._loaded = True
+        return True
+
+    def _save(self, full=False):
+        if not self.path:
+            return
+        if full:
+            self.backend.save(self.path)
+
+        # Pending changes are small, so they are rewritten on every mutation
+        pending = {
+            'delta_ids': self._ids[:self._size],
+            'delta_vectors': self._matrix[:self._size],
+            'tombstones': np.fromiter(self._tombstones, dtype=np.int64),
+            'source': self._source_fingerprint(),
+        }
+        for name, array in pending.items():
+            target = os.path.join(self.path, name + '.npy')
+            with open(target + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(target + '.tmp', target)
+
+    def _changed(self):
+        """Persist a mutation, folding pending changes into the backend when they pile up."""
+        if self.backend is None:
+            return
+        if self._size + len(self._tombstones) < self.rebuild_threshold:
+            self._save()
+            return
+
+        keep = ~np.isin(self.backend.ids, np.fromiter(self._tombstones, dtype=np.int64))
+        ids = np.concatenate((self.backend.ids[keep], self._ids[:self._size]))
+        vectors = np.concatenate((self.backend.vectors[keep], self._matrix[:self._size]))
+        self.backend.build(ids, vectors, retrain=False)
+        self._tombstones = set()
+        self._set_exact(ids[:0], vectors[:0])
+        self._save(full=True)
+
+    def _remove_rows(self, user_id):
+        """Drop a user's rows by moving the last rows of the matrix into their slots."""
+        for row in sorted(self._rows.pop(user_id, ()), reverse=True):
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved_id
+                moved_rows = self._rows[moved_id]
+                moved_rows[moved_rows.index(last)] = row
+            self._size = last
+
+    def _add_rows(self, user_id, vectors):
+        self._remove_rows(user_id)
+        start = self._size
+        self._reserve(start + len(vectors))
+        self._matrix[start:start + len(vectors)] = vectors
+        self._ids[start:start + len(vectors)] = user_id
+        self._rows[user_id] = list(range(start, start + len(vectors)))
+        self._size += len(vectors)
+        if self.backend is not None:
+            self._tombstones.add(user_id)
+
+    def add(self, user_id, embeddings):
+        """Insert or replace the embedding(s) enrolled for a user."""
+        vectors = self._normalize(embeddings)
+        if vectors is None:
+            return False
+
+        with self._lock:
+            if not self._loaded:
+                # The full gallery is read lazily; it will include these rows.
+                return True
+            self._add_rows(user_id, vectors)
+            self._changed()
+        return True
+
+    def add_many(self, entries):
+        """Insert or replace several users' embeddings, persisting once at the end."""
+        with self._lock:
+            if not self._loaded:
+                return
+            for user_id, embeddings in entries:
+                vectors = self._normalize(embeddings)
+                if vectors is not None:
+                    self._add_rows(user_id, vectors)
+            self._changed()
+
+    def remove(self, user_id):
+        """Drop every row enrolled for a user."""
+        with self._lock:
+            found = user_id in self._rows
+            self._remove_rows(user_id)
+            if self.backend is not None and self._loaded:
+                self._tombstones.add(user_id)
+                self._changed()
+                return True
+        return found
+
+    def search(self, embedding, k=1, aggregate='max'):
+        """
+        Return up to k (user_id, similarity) pairs ordered by similarity.
+
+        Each user is scored by the max or mean similarity of their rows.
+        Rows held by an ANN backend are aggregated over the rows it returned.
+        """
+        vectors = self._normalize(embedding)
+        if vectors is None:
+            return []
+        vec = vectors[0]
+        reduce = np.max if aggregate == 'max' else np.mean
+        candidates = k * self.max_templates
+
+        self.ensure_loaded()
+        scores = {}
+        with self._lock:
+            sims = self._matrix[:self._size] @ vec
+            for user_id, _ in top_k(sims, self._ids[:self._size], candidates):
+                if user_id not in scores:
+                    scores[user_id] = float(reduce(sims[self._rows[user_id]]))
+
+            if self.backend is not None:
+                found = defaultdict(list)
+                for user_id, sim in self.backend.search(vec, candidates, exclude=self._tombstones):
+                    found[user_id].append(sim)
+                for user_id, user_sims in found.items():
+                    scores[user_id] = float(reduce(user_sims))
+
+        return sorted(scores.items(), key=lambda match: match[1], reverse=True)[:k]
+
+face_index = FaceIndex()
+
+
+def default_index_path(app):
+    """Keep the persisted index next to the SQLite file, else in the instance folder."""
+    url = db.engine.url
+    if url.get_backend_name() == 'sqlite':
+        if not url.database or url.database == ':memory:':
+            return None
+        return os.path.splitext(url.database)[0] + '.faceindex'
+    return os.path.join(app.instance_path, 'faceindex')
+
+
+def configure_face_index(app):
+    """Select the gallery backend from config and reload a persisted index."""
+    backend = None
+    if app.config.get('FACE_INDEX_BACKEND') == 'ivf':
+        backend = IVFIndex(
+            nlist=app.config.get('FACE_INDEX_NLIST'),
+            nprobe=app.config.get('FACE_INDEX_NPROBE', 32),
+        )
+
+    path = app.config.get('FACE_INDEX_PATH') or default_index_path(app)
+    face_index.configure(
+        backend=backend,
+        path=path,
+        rebuild_threshold=app.config.get('FACE_INDEX_REBUILD_THRESHOLD', 1024),
+        use_templates=app.config.get('FACE_TEMPLATE_MATCH', 'max') != 'centroid',
+        max_templates=app.config.get('FACE_MAX_TEMPLATES', 5),
+    )
+    face_index.restore()
@@ -1,22 +1,158 @@
+import threading
+
 import cv2
 import numpy as np
-from insightface.app import FaceAnalysis
 
-# Initialize InsightFace app
-face_app = FaceAnalysis(name='buffalo_l')
-face_app.prepare(ctx_id=0, det_size=(640, 640))
+from utils.embeddingCodec import centroid, normalize_rows
+
+
+class FaceModel:
+    """
+    Process-wide InsightFace model that is only loaded on first use.
+
+    Importing this module is free, so processes that only serve QR or admin
+    traffic never pay for the ONNX sessions.
+    """
+
+    def __init__(self):
+        self._app = None
+        self._lock = threading.Lock()
+        self.configure()
+
+    def configure(self, name='buffalo_l', det_size=(640, 640),
+                  modules=('detection', 'recognition'), ctx_id=0,
+                  det_sizes=None, min_face_size=0, min_det_score=0.5):
+        with self._lock:
+            self.name = name
+            self.det_size = tuple(det_size)
+            self.modules = list(modules) if modules else None
+            self.ctx_id = ctx_id
+            # Detector input sizes tried in order, smallest first
+            self.det_sizes = tuple(sorted(det_sizes)) if det_sizes else (self.det_size[0],)
+            self.min_face_size = min_face_size
+            self.min_det_score = min_det_score
+            self._app = None
+
+    @property
+    def loaded(self):
+        return self._app is not None
+
+    def get(self):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    from insightface.app import FaceAnalysis
+
+                    app = FaceAnalysis(name=self.name, allowed_modules=self.modules)
+                    app.prepare(ctx_id=self.ctx_id, det_size=self.det_size)
+                    self._app = app
+        return self._app
+
+    def warmup(self):
+        """Load the model and run one dummy frame so the first request is not slow."""
+        detector = self.get().models['detection']
+        for size in self.det_sizes:
+            detector.detect(np.zeros((size, size, 3), dtype=np.uint8), input_size=(size, size))
+
+
+face_model = FaceModel()
+
+# Cosine similarity above which two embeddings are the same person
+MATCH_THRESHOLD = 0.42
+
+
+def configure_face_model(app):
+    """Apply the FACE_MODEL_* settings and optionally load the model right away."""
+    face_model.configure(
+        name=app.config.get('FACE_MODEL_NAME', 'buffalo_l'),
+        det_size=app.config.get('FACE_DET_SIZE', (640, 640)),
+        modules=app.config.get('FACE_MODEL_MODULES', ('detection', 'recognition')),
+        ctx_id=app.config.get('FACE_MODEL_CTX_ID', 0),
+        det_sizes=app.config.get('FACE_DET_SIZES'),
+        min_face_size=app.config.get('FACE_MIN_FACE_SIZE', 0),
+        min_det_score=app.config.get('FACE_MIN_DET_SCORE', 0.5),
+    )
+    if app.config.get('FACE_MODEL_WARMUP'):
+        face_model.warmup()
+
+
+def detect_faces(image, det_sizes=None):
+    """
+    Return (bboxes, kpss) of the usable faces in the frame, most confident first.
+
+    Door cameras send one close-up face, so the detector runs at the smallest
+    configured input size first and only retries larger sizes when nothing
+    confident was found. Faces smaller than ``min_face_size`` pixels are
+    dropped before recognition; a bigger detector input would not help them.
+    """
+    detector = face_model.get().models['detection']
+    for size in det_sizes or face_model.det_sizes:
+        bboxes, kpss = detector.detect(image, input_size=(size, size), max_num=0)
+        if len(bboxes) == 0:
+            continue
+        confident = bboxes[:, 4] >= face_model.min_det_score
+        if not confident.any():
+            continue
+
+        bboxes, kpss = bboxes[confident], kpss[confident]
+        sides = np.minimum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1])
+        large = sides >= face_model.min_face_size
+        return bboxes[large], kpss[large]
+    return np.empty((0, 5), dtype=np.float32), np.empty((0, 5, 2), dtype=np.float32)
+
+
+def detect_face(image, det_sizes=None):
+    """Return (bbox, kps) of the most confident face in the frame, or None."""
+    bboxes, kpss = detect_faces(image, det_sizes)
+    if len(bboxes) == 0:
+        return None
+    return bboxes[0], kpss[0]
+
+
+def align_face(image, kps):
+    """Warp a detected face into the crop the recognition model expects."""
+    from insightface.utils import face_align
+
+    recognizer = face_model.get().models['recognition']
+    return face_align.norm_crop(image, landmark=kps, image_size=recognizer.input_size[0])
+
+
+def embed_faces(crops):
+    """Compute embeddings for a list of aligned crops in one ONNX call."""
+    recognizer = face_model.get().models['recognition']
+    return recognizer.get_feat(list(crops))
+
 
 def get_embedding(image):
-    faces = face_app.get(image)
-    if len(faces) == 0:
+    face = detect_face(image)
+    if face is None:
         return None
-    return faces[0].embedding
+    return embed_faces([align_face(image, face[1])])[0]
+
+
+def match_templates(emb, templates, mode='max'):
+    """
+    Score a probe against all templates of one user in one matrix product.
+
+    ``mode`` is 'max' (best template), 'mean' (average over templates) or
+    'centroid' (one dot product with the normalized mean template).
+    """
+    templates = np.asarray(templates, dtype=np.float32)
+    if emb is None or templates.size == 0:
+        return 0.0
+    probe = np.asarray(emb, dtype=np.float32)
+    probe = probe / np.linalg.norm(probe)
+    if mode == 'centroid':
+        return float(centroid(templates) @ probe)
+    sims = normalize_rows(templates) @ probe
+    return float(sims.max() if mode == 'max' else sims.mean())
+
 
-def authenticate(image, user_emb, threshold=0.42):
+def authenticate(image, templates, threshold=MATCH_THRESHOLD, mode='max'):
     emb = get_embedding(image)
-    if emb is None or user_emb is None:
+    if emb is None or templates is None:
         return False, 0.0
-    sim = np.dot(emb, user_emb) / (np.linalg.norm(emb) * np.linalg.norm(user_emb))
+    sim = match_templates(emb, templates, mode)
     return sim > threshold, sim
 
 
@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import NamedTuple
+
+from flask import g
+
+from models import db, User
+
+
+class Identity(NamedTuple):
+    id: int
+    email: str
+    is_admin: bool
+
+
+class IdentityCache:
+    """
+    Short-lived, in-process map from JWT identity (email) to the user's id
+    and admin flag, also looked up by id for QR scans.
+
+    Authorization checks read from here instead of querying users on every
+    request. Entries live ``ttl`` seconds, so changes made by another
+    worker show up within that time; changes made by this worker call
+    invalidate() and apply at once.
+    """
+
+    def __init__(self, ttl=30, max_size=10000):
+        self._lock = threading.Lock()
+        self._entries = {}  # email -> (expires_at, Identity)
+        self._emails = {}  # user id -> email
+        self.configure(ttl, max_size)
+
+    def configure(self, ttl=30, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._emails = {}
+
+    def get(self, email):
+        entry = self._entries.get(email)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            with self._lock:
+                self._entries.pop(email, None)
+            return None
+        return entry[1]
+
+    def get_by_id(self, user_id):
+        identity = self.get(self._emails.get(user_id))
+        return identity if identity is not None and identity.id == user_id else None
+
+    def put(self, user):
+        identity = Identity(user.id, user.email, bool(user.is_admin))
+        if self.ttl <= 0:
+            return identity
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries = {email: entry for email, entry in self._entries.items() if entry[0] >= now}
+                if len(self._entries) >= self.max_size:
+                    self._entries = {}
+                self._emails = {entry[1].id: email for email, entry in self._entries.items()}
+            self._entries[identity.email] = (now + self.ttl, identity)
+            self._emails[identity.id] = identity.email
+        return identity
+
+    def invalidate(self, user_id=None, email=None):
+        """Forget a user after it was updated or deleted."""
+        with self._lock:
+            for key, (_, identity) in list(self._entries.items()):
+                if key == email or identity.id == user_id:
+                    del self._entries[key]
+                    self._emails.pop(identity.id, None)
+
+
+identity_cache = IdentityCache()
+
+
+def load_identity(email):
+    """Identity of ``email`` from the cache, falling back to one query; None if the user is gone."""
+    identity = identity_cache.get(email)
+    if identity is None:
+        user = User.query.filter_by(email=email).first()
+        if user is None:
+            return None
+        identity = identity_cache.put(user)
+    return identity
+
+
+def load_identity_by_id(user_id):
+    """load_identity() for a user id, e.g. one taken from a verified QR token."""
+    identity = identity_cache.get_by_id(user_id)
+    if identity is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        identity = identity_cache.put(user)
+    return identity
+
+
+def current_identity():
+    """The Identity resolved for this request by admin_required(), if any."""
+    return g.get('identity')
+
+
+def configure_identity_cache(app):
+    identity_cache.configure(
+        ttl=app.config.get('IDENTITY_CACHE_TTL', 30),
+        max_size=app.config.get('IDENTITY_CACHE_SIZE', 10000),
+    )
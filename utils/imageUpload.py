@@ -0,0 +1,89 @@
+import base64
+
+import cv2
+import numpy as np
+from flask import request
+
+# Request bodies that carry the image bytes directly
+BINARY_TYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+
+# Channels per pixel of a pre-decoded frame (X-Frame-Format header)
+RAW_FORMATS = {'BGR': 3, 'GRAY': 1}
+
+
+def read_body(stream, length):
+    """Read exactly ``length`` bytes from ``stream`` into one preallocated array."""
+    buffer = np.empty(length, dtype=np.uint8)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < length:
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+    return buffer[:filled]
+
+
+def raw_frame(buffer, width, height, fmt):
+    """Wrap a pre-decoded BGR/GRAY frame without running imdecode."""
+    channels = RAW_FORMATS.get(fmt.upper())
+    if channels is None:
+        return None, f'Unsupported frame format {fmt}'
+    if len(buffer) != width * height * channels:
+        return None, 'Frame size does not match width and height'
+    if channels == 1:
+        return cv2.cvtColor(buffer.reshape(height, width), cv2.COLOR_GRAY2BGR), None
+    return buffer.reshape(height, width, 3), None
+
+
+def decode(buffer):
+    if len(buffer) == 0:
+        return None, 'No image provided'
+    image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if image is None:
+        return None, 'Invalid image'
+    return image, None
+
+
+def read_request_image(field='image', max_bytes=None):
+    """
+    Return ``(image, error)`` for the frame sent with the current request.
+
+    Accepted, in order of preference:
+      - raw ``image/jpeg``, ``image/png`` or ``application/octet-stream``
+        bodies, read straight into a preallocated buffer; with
+        ``X-Frame-Width``/``X-Frame-Height`` (and optional ``X-Frame-Format``
+        BGR or GRAY) the body is taken as decoded pixels and imdecode is skipped
+      - multipart uploads under ``field``
+      - JSON ``{field: "<data URL or base64>"}`` (legacy frontend)
+    """
+    mimetype = request.mimetype
+    if mimetype in BINARY_TYPES:
+        length = request.content_length
+        if not length:
+            return None, 'Empty request body'
+        if max_bytes and length > max_bytes:
+            return None, 'Image too large'
+        buffer = read_body(request.stream, length)
+
+        width = request.headers.get('X-Frame-Width', type=int)
+        height = request.headers.get('X-Frame-Height', type=int)
+        if width and height:
+            return raw_frame(buffer, width, height, request.headers.get('X-Frame-Format', 'BGR'))
+        return decode(buffer)
+
+    if field in request.files:
+        return decode(np.frombuffer(request.files[field].read(), np.uint8))
+
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        encoded = data.get(field)
+        if not encoded:
+            return None, 'No image provided'
+        try:
+            raw = base64.b64decode(encoded.split(',')[-1])
+        except (ValueError, TypeError):
+            return None, 'Invalid base64 image'
+        return decode(np.frombuffer(raw, np.uint8))
+
+    return None, 'No image provided'
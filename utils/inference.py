@@ -0,0 +1,213 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import numpy as np
+
+from utils.faceRecognition import detect_face, align_face, embed_faces
+
+_STOP = object()
+
+
+class InferenceError(Exception):
+    """The model failed on a frame."""
+
+
+class InferenceTimeout(InferenceError):
+    """A frame got no result within the service timeout."""
+
+
+class InferenceStats:
+    """Rolling window of batch sizes and per-stage latencies (milliseconds)."""
+
+    STAGES = ('queue_wait', 'detect', 'recognize', 'total')
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.batch_sizes = deque(maxlen=window)
+        self.latencies = {stage: deque(maxlen=window) for stage in self.STAGES}
+        self.frames = 0
+        self.batches = 0
+        self.errors = 0
+
+    def record(self, batch_size, queue_wait, detect, recognize, total):
+        with self._lock:
+            self.batches += 1
+            self.frames += batch_size
+            self.batch_sizes.append(batch_size)
+            self.latencies['queue_wait'].extend(queue_wait)
+            self.latencies['detect'].append(detect)
+            self.latencies['recognize'].append(recognize)
+            self.latencies['total'].extend(total)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for stage, values in self.latencies.items():
+                values = np.fromiter(values, dtype=np.float64)
+                stages[stage] = {
+                    'mean_ms': round(float(values.mean()), 2) if len(values) else 0.0,
+                    'p95_ms': round(float(np.percentile(values, 95)), 2) if len(values) else 0.0,
+                }
+            sizes = np.fromiter(self.batch_sizes, dtype=np.float64)
+            return {
+                'frames': self.frames,
+                'batches': self.batches,
+                'errors': self.errors,
+                'mean_batch_size': round(float(sizes.mean()), 2) if len(sizes) else 0.0,
+                'max_batch_size': int(sizes.max()) if len(sizes) else 0,
+                'stages': stages,
+            }
+
+
+class InferenceService:
+    """
+    Single model-owning worker that turns frames into face embeddings.
+
+    Request threads only enqueue a frame and wait on a future. The worker
+    collects whatever arrives within ``max_wait_ms`` (up to
+    ``max_batch_size`` frames), detects a face in each and runs recognition
+    for all of them in one ONNX call.
+    """
+
+    def __init__(self, max_batch_size=16, max_wait_ms=5, max_queue=256, timeout=10):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats = InferenceStats()
+        self.configure(max_batch_size, max_wait_ms, max_queue, timeout)
+
+    def configure(self, max_batch_size=16, max_wait_ms=5, max_queue=256, timeout=10):
+        self.stop()
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='face-inference', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def submit(self, image):
+        """Queue a frame; raises queue.Full at once when the worker is saturated."""
+        self.start()
+        future = Future()
+        self._queue.put_nowait((image, future, time.perf_counter()))
+        return future
+
+    def embed(self, image):
+        """
+        Embedding of the most confident face in ``image``, or None.
+
+        Raises queue.Full when the queue is full, InferenceTimeout after
+        ``timeout`` seconds without a result and InferenceError when the
+        model failed.
+        """
+        future = self.submit(image)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()  # the worker drops it if it has not started on it yet
+            raise InferenceTimeout(f'No embedding within {self.timeout} s') from None
+        except Exception as e:
+            raise InferenceError(str(e)) from e
+
+    def report(self):
+        data = self.stats.snapshot()
+        data['queue_depth'] = self.queue_depth
+        data['max_batch_size_config'] = self.max_batch_size
+        data['max_wait_ms'] = self.max_wait * 1000.0
+        return data
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            # Frames whose caller timed out were cancelled and are not worth the model time
+            batch = [item for item in self._collect(first) if item[1].set_running_or_notify_cancel()]
+            if batch:
+                self._process(batch)
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        crops, owners = [], []
+        for index, (image, future, _) in enumerate(batch):
+            # One bad frame only fails its own request, not the whole micro-batch
+            try:
+                face = detect_face(image)
+                if face is None:
+                    future.set_result(None)
+                    continue
+                crops.append(align_face(image, face[1]))
+            except Exception as e:
+                self.stats.record_error()
+                future.set_exception(e)
+                continue
+            owners.append(index)
+        detected = time.perf_counter()
+
+        if crops:
+            try:
+                embeddings = embed_faces(crops)
+            except Exception as e:
+                self.stats.record_error()
+                for index in owners:
+                    batch[index][1].set_exception(e)
+                return
+            for index, embedding in zip(owners, embeddings):
+                batch[index][1].set_result(embedding)
+        recognized = time.perf_counter()
+
+        self.stats.record(
+            batch_size=len(batch),
+            queue_wait=[(started - enqueued) * 1000 for _, _, enqueued in batch],
+            detect=(detected - started) * 1000,
+            recognize=(recognized - detected) * 1000,
+            total=[(recognized - enqueued) * 1000 for _, _, enqueued in batch],
+        )
+
+
+inference_service = InferenceService()
+
+
+def configure_inference(app):
+    inference_service.configure(
+        max_batch_size=app.config.get('FACE_BATCH_MAX_SIZE', 16),
+        max_wait_ms=app.config.get('FACE_BATCH_MAX_WAIT_MS', 5),
+        max_queue=app.config.get('FACE_QUEUE_SIZE', 256),
+        timeout=app.config.get('FACE_INFERENCE_TIMEOUT', 10),
+    )
@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, Index, MetaData, Table, and_, delete, func, insert, not_, select
+
+from models import db, Log, LogArchive
+from utils.pagination import after
+
+logger = logging.getLogger(__name__)
+
+# Archive tables are created on demand, not by db.create_all()
+archive_metadata = MetaData()
+
+COLUMNS = ('id', 'user_id', 'access_granted', 'error_log', 'method', 'created_at')
+
+
+def month_range(month):
+    """'YYYY-MM' -> (first instant of the month, first instant of the next one)."""
+    start = datetime.strptime(month, '%Y-%m')
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def archive_table(month):
+    """The logs_YYYYMM table holding the archived logs of ``month`` ('YYYY-MM')."""
+    name = 'logs_' + month.replace('-', '')
+    table = archive_metadata.tables.get(name)
+    if table is None:
+        table = Table(
+            name, archive_metadata,
+            *(Column(column.name, column.type, primary_key=column.primary_key)
+              for column in Log.__table__.columns if column.name in COLUMNS),
+            Index(f'ix_{name}_created_at', 'created_at'),
+            Index(f'ix_{name}_user_id_created_at', 'user_id', 'created_at'),
+        )
+    return table
+
+
+def log_sources(start=None, end=None):
+    """
+    Tables holding logs between ``start`` and ``end``, newest first, as
+    (table, end of its range) pairs. The hot logs table comes first with no
+    bound, followed by the archived months overlapping the range.
+    """
+    query = db.session.query(LogArchive.month).order_by(LogArchive.month.desc())
+    sources = [(Log.__table__, None)]
+    for (month,) in query:
+        month_start, month_end = month_range(month)
+        if (start is None or month_end > start) and (end is None or month_start <= end):
+            sources.append((archive_table(month), month_end))
+    return sources
+
+
+def _move_batch(table, bound, batch_size):
+    """Move the oldest ``batch_size`` logs before ``bound`` into ``table`` in one transaction."""
+    hot = Log.__table__
+    last = db.session.execute(
+        select(hot.c.created_at, hot.c.id).where(hot.c.created_at < bound)
+        .order_by(hot.c.created_at, hot.c.id).offset(batch_size - 1).limit(1)
+    ).first()
+
+    condition = hot.c.created_at < bound
+    if last is not None:
+        condition = and_(condition, not_(after((hot.c.created_at, hot.c.id), tuple(last), descending=False)))
+
+    moved = db.session.execute(
+        insert(table).from_select(COLUMNS, select(*(hot.c[name] for name in COLUMNS)).where(condition))
+    ).rowcount
+    db.session.execute(delete(hot).where(condition))
+    db.session.query(LogArchive).filter_by(table_name=table.name).update(
+        {LogArchive.row_count: LogArchive.row_count + moved, LogArchive.archived_at: datetime.utcnow()}
+    )
+    db.session.commit()
+    return moved
+
+
+def archive_logs(older_than, batch_size=5000, pause=0.05):
+    """
+    Move logs created before ``older_than`` into per-month archive tables.
+
+    Every batch is copied and deleted in its own short transaction, with a
+    ``pause`` (seconds) in between so door events are not kept waiting on
+    the write lock. Returns the number of rows moved.
+    """
+    moved = 0
+    while True:
+        oldest = db.session.query(func.min(Log.created_at)).filter(Log.created_at < older_than).scalar()
+        if oldest is None:
+            return moved
+
+        month = oldest.strftime('%Y-%m')
+        table = archive_table(month)
+        table.create(bind=db.engine, checkfirst=True)
+        if db.session.get(LogArchive, month) is None:
+            db.session.add(LogArchive(month=month, table_name=table.name, row_count=0))
+            db.session.commit()
+
+        bound = min(older_than, month_range(month)[1])
+        while True:
+            count = _move_batch(table, bound, batch_size)
+            moved += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+
+
+def start_archiver(app, interval):
+    """Archive logs older than LOG_RETENTION_DAYS every ``interval`` seconds."""
+    def run():
+        while True:
+            with app.app_context():
+                try:
+                    older_than = datetime.utcnow() - timedelta(days=app.config['LOG_RETENTION_DAYS'])
+                    moved = archive_logs(
+                        older_than,
+                        batch_size=app.config.get('LOG_ARCHIVE_BATCH_SIZE', 5000),
+                        pause=app.config.get('LOG_ARCHIVE_PAUSE_MS', 50) / 1000.0,
+                    )
+                    if moved:
+                        logger.info('Archived %d access logs older than %s', moved, older_than)
+                except Exception:
+                    logger.exception('Archiving access logs failed')
+                finally:
+                    db.session.remove()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='log-archiver', daemon=True)
+    thread.start()
+    return thread
+
+
+def configure_log_archive(app):
+    if app.config.get('LOG_RETENTION_DAYS') and app.config.get('LOG_ARCHIVE_INTERVAL', 0) > 0:
+        start_archiver(app, app.config['LOG_ARCHIVE_INTERVAL'])
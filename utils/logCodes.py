@@ -0,0 +1,38 @@
+# Access methods, stored in Log.method.
+# The codes are persisted, so never renumber them.
+METHOD_UNKNOWN = 0
+METHOD_QR = 1
+METHOD_FACE = 2
+METHOD_FACE_STREAM = 3
+
+METHODS = {
+    METHOD_UNKNOWN: 'unknown',
+    METHOD_QR: 'qr',
+    METHOD_FACE: 'face',
+    METHOD_FACE_STREAM: 'face_stream',
+}
+
+# Log messages with a fixed code, so a journal record can carry them in two
+# bytes. Code 0 means no message. Append new messages, never renumber.
+ERROR_MESSAGES = {
+    1: 'QR authentication successful',
+    2: 'Invalid or expired QR token',
+    3: 'access granted',
+    4: 'face not recognized',
+    5: 'Face not recognized',
+    6: 'No face detected',
+    7: 'Account expired',
+}
+
+ERROR_CODES = {message: code for code, message in ERROR_MESSAGES.items()}
+
+
+def error_code(message):
+    """Code of a known log message, 0 for None, or None if it has no code."""
+    if message is None:
+        return 0
+    return ERROR_CODES.get(message)
+
+
+def method_name(method):
+    return METHODS.get(method or METHOD_UNKNOWN, 'unknown')
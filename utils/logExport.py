@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+
+from models import db, Log
+from utils.logArchive import log_sources
+from utils.logCodes import method_name
+
+COLUMNS = ('id', 'user_id', 'user_email', 'access_granted', 'method', 'error_log', 'created_at')
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def export_statement(table=None, start=None, end=None, user_id=None, access_granted=None):
+    """Logs of ``table`` (default: logs) joined with the user email, oldest first; ``end`` is exclusive."""
+    statement = Log.listing(table)
+    columns = statement.selected_columns
+    if start is not None:
+        statement = statement.where(columns.created_at >= start)
+    if end is not None:
+        statement = statement.where(columns.created_at < end)
+    if user_id is not None:
+        statement = statement.where(columns.user_id == user_id)
+    if access_granted is not None:
+        statement = statement.where(columns.access_granted == access_granted)
+    return statement.order_by(columns.created_at, columns.id)
+
+
+def iter_batches(statements, batch_size=5000):
+    """
+    Run each statement on a server-side cursor and yield lists of rows.
+
+    yield_per keeps only one batch of rows in memory at a time, however
+    many the export covers.
+    """
+    for statement in statements:
+        result = db.session.execute(statement.execution_options(yield_per=batch_size))
+        try:
+            for rows in result.partitions():
+                yield rows
+        finally:
+            result.close()
+
+
+def _record(row):
+    return (
+        row.id, row.user_id, row.user_email, row.access_granted, method_name(row.method),
+        row.error_log, row.created_at.isoformat() if row.created_at else None,
+    )
+
+
+def to_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(_record(row) for row in rows)
+        yield buffer.getvalue()
+
+
+def to_ndjson(batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(COLUMNS, _record(row))), ensure_ascii=False) + '\n' for row in rows)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands its bytes out in pieces but keeps counting positions."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def to_parquet(batches):
+    """One Parquet row group per batch; needs the optional pyarrow package."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('id', pa.int64()), ('user_id', pa.int32()), ('user_email', pa.string()),
+        ('access_granted', pa.bool_()), ('method', pa.dictionary(pa.int8(), pa.string())),
+        ('error_log', pa.string()), ('created_at', pa.timestamp('us')),
+    ])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for rows in batches:
+            # By name: the select's column order is Log.listing()'s, not the schema's
+            columns = {name: [getattr(row, name) for row in rows] for name in COLUMNS}
+            columns['method'] = [method_name(method) for method in columns['method']]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(columns[field.name], type=field.type) for field in schema], schema=schema
+            ))
+            # Hand over what was written so far instead of keeping the whole file
+            yield sink.take()
+    yield sink.take()
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+WRITERS = {'csv': to_csv, 'ndjson': to_ndjson, 'parquet': to_parquet}
+
+
+def export_logs(fmt, batch_size=5000, start=None, end=None, **filters):
+    """
+    Yield the chunks (str, or bytes for parquet) of an export in format
+    ``fmt``, reading archived months before the hot logs table.
+    """
+    tables = [table for table, _ in reversed(log_sources(start, end))]
+    statements = [export_statement(table, start, end, **filters) for table in tables]
+    return WRITERS[fmt](iter_batches(statements, batch_size))
@@ -0,0 +1,168 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Log, LogRollup
+from utils.logArchive import log_sources
+from utils.logCodes import METHODS, METHOD_FACE, METHOD_FACE_STREAM, METHOD_UNKNOWN
+
+PERIODS = {
+    'hour': lambda moment: moment.replace(minute=0, second=0, microsecond=0),
+    'day': lambda moment: moment.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+COUNTERS = ['attempts', 'grants', 'denials'] + [f'{name}_attempts' for name in METHODS.values()]
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _unpack_users(blob):
+    return np.frombuffer(blob or b'', dtype='<i4')
+
+
+def aggregate(rows):
+    """Fold log rows (dicts of Log columns) into per-bucket counters and user sets."""
+    buckets = defaultdict(lambda: dict.fromkeys(COUNTERS, 0) | {'users': set()})
+    for row in rows:
+        created_at = row['created_at']
+        method = METHODS.get(row.get('method') or METHOD_UNKNOWN, 'unknown')
+        for period, floor in PERIODS.items():
+            bucket = buckets[(period, floor(created_at))]
+            bucket['attempts'] += 1
+            bucket['grants' if row['access_granted'] else 'denials'] += 1
+            bucket[f'{method}_attempts'] += 1
+            if row['user_id'] is not None and row['user_id'] >= 0:
+                bucket['users'].add(row['user_id'])
+    return buckets
+
+
+def update_rollups(executor, rows):
+    """
+    Add freshly written log rows to the hourly and daily rollups.
+
+    ``executor`` is the session or connection that wrote the rows, so the
+    rollups commit or roll back together with them. Counters are
+    incremented with an upsert, which also locks the bucket row while its
+    user set is merged.
+    """
+    upsert = UPSERT_DIALECTS.get(db.engine.dialect.name)
+    for (period, bucket), values in aggregate(rows).items():
+        counts = {name: values[name] for name in COUNTERS}
+        key = (LogRollup.period == period, LogRollup.bucket == bucket)
+
+        if upsert is not None:
+            statement = upsert(LogRollup).values(period=period, bucket=bucket, **counts)
+            executor.execute(statement.on_conflict_do_update(
+                index_elements=['period', 'bucket'],
+                set_={name: getattr(LogRollup, name) + statement.excluded[name] for name in COUNTERS},
+            ))
+            users = executor.execute(select(LogRollup.user_ids).where(*key)).scalar()
+        else:
+            found = executor.execute(select(LogRollup.user_ids).where(*key)).first()
+            if found is None:
+                executor.execute(insert(LogRollup).values(period=period, bucket=bucket, **counts))
+            else:
+                executor.execute(update(LogRollup).where(*key).values(
+                    {name: getattr(LogRollup, name) + value for name, value in counts.items()}
+                ))
+            users = found.user_ids if found is not None else None
+
+        merged = np.union1d(_unpack_users(users), np.fromiter(values['users'], dtype='<i4'))
+        executor.execute(update(LogRollup).where(*key).values(user_ids=merged.astype('<i4').tobytes()))
+
+
+def _ceil(period, moment):
+    floor = PERIODS[period](moment)
+    if floor == moment:
+        return floor
+    return floor + (timedelta(hours=1) if period == 'hour' else timedelta(days=1))
+
+
+def window_stats(since, until):
+    """
+    Counters and distinct users for [since, until].
+
+    Whole days come from the daily rollups and the hours around them
+    (including the current, partial hour) from the hourly ones. Only the
+    logs between ``since`` and the next whole hour are read from the raw
+    table.
+    """
+    first_hour = _ceil('hour', since)
+    first_day, last_day = _ceil('day', first_hour), PERIODS['day'](until)
+
+    ranges = []
+    if first_day < last_day:
+        ranges += [('hour', first_hour, first_day), ('day', first_day, last_day), ('hour', last_day, until)]
+    else:
+        ranges.append(('hour', first_hour, until))
+
+    totals = dict.fromkeys(COUNTERS, 0)
+    users = [np.empty(0, dtype='<i4')]
+    for period, start, stop in ranges:
+        rows = db.session.execute(
+            select(LogRollup).where(LogRollup.period == period, LogRollup.bucket >= start, LogRollup.bucket < stop)
+        ).scalars()
+        for rollup in rows:
+            for name in COUNTERS:
+                totals[name] += getattr(rollup, name) or 0
+            users.append(_unpack_users(rollup.user_ids))
+
+    # Partial leading bucket: logs from ``since`` up to the first whole hour,
+    # which may already sit in an archive table
+    if since < first_hour:
+        partial = []
+        for table, _ in log_sources(since, first_hour):
+            partial += db.session.execute(
+                select(table.c.user_id, table.c.access_granted, table.c.method, table.c.created_at)
+                .where(table.c.created_at >= since, table.c.created_at < first_hour)
+            ).mappings().all()
+        for (period, _), values in aggregate(partial).items():
+            if period == 'hour':  # the same rows also fill a daily bucket
+                for name in COUNTERS:
+                    totals[name] += values[name]
+                users.append(np.fromiter(values['users'], dtype='<i4'))
+
+    totals['unique_users'] = int(len(np.unique(np.concatenate(users))))
+    return totals
+
+
+def log_stats(days):
+    """Payload of GET /log/stats for the last ``days`` days."""
+    until = datetime.utcnow()
+    totals = window_stats(until - timedelta(days=days), until)
+
+    attempts = totals['attempts']
+    return {
+        'total_attempts': attempts,
+        'successful_attempts': totals['grants'],
+        'failed_attempts': totals['denials'],
+        'success_rate': round(totals['grants'] / attempts * 100, 2) if attempts else 0,
+        'unique_users': totals['unique_users'],
+        'biometric_attempts': sum(totals[f'{METHODS[method]}_attempts']
+                                  for method in (METHOD_FACE, METHOD_FACE_STREAM)),
+        'methods': {name: totals[f'{name}_attempts'] for name in METHODS.values()},
+    }
+
+
+def backfill_rollups(after_id=0, until_id=None, batch_size=10000):
+    """
+    Add one batch of logs with ids in (after_id, until_id] to the rollups.
+
+    ``until_id`` is the newest log id when the backfill started: later
+    logs were counted by the writer that inserted them. Returns (last id
+    of the batch, rows read), the id being None when no row is left; the
+    caller commits.
+    """
+    statement = select(Log.id, Log.user_id, Log.access_granted, Log.method, Log.created_at) \
+        .where(Log.id > after_id, Log.created_at.isnot(None))
+    if until_id is not None:
+        statement = statement.where(Log.id <= until_id)
+    rows = db.session.execute(statement.order_by(Log.id).limit(batch_size)).mappings().all()
+    if not rows:
+        return None, 0
+    update_rollups(db.session, rows)
+    return rows[-1]['id'], len(rows)
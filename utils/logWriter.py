@@ -0,0 +1,202 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models import db, Log
+from utils.logCodes import METHOD_UNKNOWN
+from utils.logRollup import update_rollups
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# What write() does when the queue is full
+OVERFLOW_POLICIES = ('block', 'sync', 'drop')
+
+
+class LogWriter:
+    """
+    Background sink for access log rows.
+
+    Request threads only put a row on a bounded queue. A writer thread
+    drains it and inserts up to ``max_batch`` rows with one executemany in
+    a single transaction, either when the batch is full or
+    ``flush_interval_ms`` after its first row arrived, so doors no longer
+    wait on the database write lock and an fsync per event.
+
+    When the queue is full, ``overflow`` decides: 'block' waits up to
+    ``block_timeout`` seconds and then writes inline, 'sync' writes inline
+    right away, 'drop' discards the row and counts it. ``sync=True`` skips
+    the thread and writes every row immediately, which is what tests want.
+    """
+
+    def __init__(self, sync=False, max_batch=500, flush_interval_ms=200, max_queue=10000,
+                 overflow='block', block_timeout=1.0):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._app = None
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.batches = 0
+        self.configure(sync, max_batch, flush_interval_ms, max_queue, overflow, block_timeout)
+        atexit.register(self.stop)
+
+    def configure(self, sync=False, max_batch=500, flush_interval_ms=200, max_queue=10000,
+                  overflow='block', block_timeout=1.0, app=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown log overflow policy {overflow!r}, expected one of {", ".join(OVERFLOW_POLICIES)}')
+        self.stop()
+        self.sync = sync
+        self.max_batch = max(1, int(max_batch))
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._app = app
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Flush every queued row and stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+
+    def write(self, row):
+        """Queue one row (a dict of Log columns) for insertion."""
+        if self.sync:
+            self._insert([row])
+            return
+
+        self.start()
+        try:
+            if self.overflow == 'block':
+                self._queue.put(row, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            if self.overflow == 'drop':
+                self.dropped += 1
+                logger.warning('Access log queue full, dropped a log row')
+            else:
+                self._insert([row])
+
+    def report(self):
+        return {
+            'mode': 'sync' if self.sync else 'async',
+            'queue_depth': self.queue_depth,
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+    def _insert(self, rows):
+        if self._app is not None:
+            with self._app.app_context():
+                self._execute(rows)
+        else:
+            self._execute(rows)
+
+    def _execute(self, rows):
+        with db.engine.begin() as conn:
+            conn.execute(insert(Log), rows)
+            update_rollups(conn, rows)
+        self.written += len(rows)
+        self.batches += 1
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        stop = False
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _flush(self, batch, attempts=3):
+        for attempt in range(attempts):
+            try:
+                self._insert(batch)
+                return
+            except Exception:
+                logger.exception('Writing %d access log rows failed (attempt %d)', len(batch), attempt + 1)
+                time.sleep(0.1 * (attempt + 1))
+        self.errors += len(batch)
+
+    def _drain(self):
+        """Flush rows that were queued behind the stop marker."""
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.max_batch:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                self._drain()
+                return
+            batch, stop = self._collect(first)
+            self._flush(batch)
+            if stop:
+                self._drain()
+                return
+
+
+log_writer = LogWriter()
+
+
+def log_row(user_id, access_granted, error_log=None, method=METHOD_UNKNOWN):
+    """Log columns for one event, timestamped when it happened rather than when it is flushed."""
+    return {
+        'user_id': user_id,
+        'access_granted': access_granted,
+        'error_log': error_log,
+        'method': method,
+        'created_at': datetime.utcnow(),
+    }
+
+
+def configure_log_writer(app):
+    log_writer.configure(
+        sync=app.config.get('LOG_WRITER_SYNC', False),
+        max_batch=app.config.get('LOG_WRITER_MAX_BATCH', 500),
+        flush_interval_ms=app.config.get('LOG_WRITER_FLUSH_MS', 200),
+        max_queue=app.config.get('LOG_WRITER_QUEUE_SIZE', 10000),
+        overflow=app.config.get('LOG_WRITER_OVERFLOW', 'block'),
+        block_timeout=app.config.get('LOG_WRITER_BLOCK_TIMEOUT', 1.0),
+        app=app,
+    )
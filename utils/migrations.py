@@ -0,0 +1,273 @@
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, type_coerce, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Log, LogRollup, SchemaMigration, User
+from utils.embeddingCodec import format_code
+from utils.embeddingMigration import ensure_biometric_columns, migrate_biometric_json, migrate_user_templates
+from utils.logCodes import METHOD_UNKNOWN
+from utils.logRollup import backfill_rollups
+from utils.schema import add_missing_columns, create_missing_indexes
+
+logger = logging.getLogger(__name__)
+
+# An unfinished data migration not heard of for this long belongs to a
+# process that died, and the next runner resumes it from its checkpoint
+STALE_AFTER = timedelta(minutes=5)
+
+# updated_at of a migration that was registered but no runner has started yet
+NOT_STARTED = datetime(1970, 1, 1)
+
+
+class Migration:
+    """
+    One change to the database, applied once and recorded in schema_migrations.
+
+    A schema migration has ``apply()``: quick DDL that is safe to run
+    again. A data migration has ``step(checkpoint, batch_size)``, which
+    processes the batch after ``checkpoint`` inside the runner's
+    transaction and returns (next checkpoint, rows read), with None as
+    checkpoint when nothing is left.
+
+    ``skip()`` (the database already has the change) and ``start()`` (the
+    first checkpoint) are asked once, when a runner first sees the
+    migration, and their answers are recorded. The server runs them at
+    startup before it writes anything, so they describe the database as
+    this code found it even if the data migration runs much later.
+    """
+
+    def __init__(self, id, description, apply=None, step=None, skip=None, start=None):
+        self.id = id
+        self.description = description
+        self.apply = apply
+        self.step = step
+        self.skip = skip
+        self.start = start
+
+    @property
+    def kind(self):
+        return 'data' if self.step is not None else 'schema'
+
+
+def _newest_log():
+    return {'after': 0, 'until': db.session.query(func.max(Log.id)).scalar() or 0}
+
+
+def _until_newest_log(migrate):
+    """Wrap a logs step so it stops at the newest log of its start() or first batch."""
+    def step(checkpoint, batch_size):
+        checkpoint = checkpoint or _newest_log()
+        last_id, rows = migrate(checkpoint['after'], checkpoint['until'], batch_size)
+        return (dict(checkpoint, after=last_id) if last_id is not None else None), rows
+    return step
+
+
+def _by_user_id(migrate):
+    """Wrap a users step whose checkpoint is the last user id."""
+    def step(checkpoint, batch_size):
+        return migrate(checkpoint or 0, batch_size)
+    return step
+
+
+def _fill_log_method(after_id, until_id, batch_size):
+    """Set method of logs from before it was recorded to unknown, one id range at a time."""
+    if after_id >= until_id:
+        return None, 0
+    last_id = min(after_id + batch_size, until_id)
+    result = db.session.execute(
+        update(Log).where(Log.id > after_id, Log.id <= last_id, Log.method.is_(None)).values(method=METHOD_UNKNOWN)
+    )
+    return last_id, result.rowcount
+
+
+def _pad_expire_time():
+    """Bulk expiry extensions on SQLite stored milliseconds, which sort wrongly against microseconds."""
+    if db.engine.dialect.name == 'sqlite':
+        text = type_coerce(User.expire_time, db.String)
+        db.session.execute(update(User).where(func.length(text) == 23).values(expire_time=text.concat('000')))
+
+
+MIGRATIONS = [
+    Migration('0001_biometric_columns', 'Binary embedding columns on users', apply=ensure_biometric_columns),
+    Migration('0002_biometric_blobs', 'Convert JSON embeddings into binary blobs', step=_by_user_id(
+        lambda after_id, batch_size: migrate_biometric_json(
+            format_code(current_app.config['FACE_EMBEDDING_FORMAT']), after_id, batch_size))),
+    Migration('0003_face_templates', 'First face template for users enrolled before templates',
+              step=_by_user_id(migrate_user_templates)),
+    Migration('0004_users_token_version', 'users.token_version for QR token revocation',
+              apply=lambda: add_missing_columns('users', {'token_version': db.Integer()})),
+    Migration('0005_logs_method', 'logs.method',
+              apply=lambda: add_missing_columns('logs', {'method': db.SmallInteger()})),
+    Migration('0006_logs_indexes', 'Composite (filter, created_at) indexes on logs',
+              apply=lambda: create_missing_indexes(Log)),
+    Migration('0007_users_indexes', 'Index on users.expire_time', apply=lambda: create_missing_indexes(User)),
+    # The log writer counts every log from the first startup on, so the backfill stops at the newest
+    # log of that moment, and is skipped when rollups were already kept before migrations existed
+    Migration('0008_log_rollups', 'Backfill hourly and daily log rollups', step=_until_newest_log(backfill_rollups),
+              skip=lambda: db.session.query(LogRollup.period).first() is not None, start=_newest_log),
+    Migration('0009_logs_method_backfill', 'Logs without method become unknown',
+              step=_until_newest_log(_fill_log_method)),
+    Migration('0010_users_expire_time_format', 'Microsecond expire_time text on SQLite', apply=_pad_expire_time),
+]
+
+
+def _register(migration, now):
+    """Record ``migration`` with its skip() and start() answers; None if another process just did."""
+    skipped = migration.skip is not None and migration.skip()
+    record = SchemaMigration(
+        id=migration.id,
+        started_at=now,
+        updated_at=now if skipped else NOT_STARTED,
+        finished_at=now if skipped else None,
+        checkpoint=json.dumps(migration.start()) if migration.start is not None and not skipped else None,
+        skipped=skipped,
+    )
+    db.session.add(record)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return db.session.get(SchemaMigration, migration.id)
+    if skipped:
+        logger.info('Migration %s skipped, the database already has it', migration.id)
+    return record
+
+
+def _claim(migration, record, now):
+    """Record that this process runs ``migration``; None if another live process does."""
+    if record is None:
+        record = SchemaMigration(id=migration.id, started_at=now, updated_at=now)
+        db.session.add(record)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return record
+
+    # Schema migrations are safe to run twice; a data migration is taken
+    # over once stale, and only one process wins this compare-and-set
+    cutoff = now - STALE_AFTER if migration.kind == 'data' else now
+    taken = db.session.execute(
+        update(SchemaMigration)
+        .where(SchemaMigration.id == migration.id, SchemaMigration.updated_at <= cutoff)
+        .values(updated_at=now)
+    ).rowcount
+    db.session.commit()
+    if not taken:
+        return None
+    db.session.refresh(record)
+    return record
+
+
+def _run_one(migration, record, batch_size, pause):
+    started = time.perf_counter()
+    elapsed_before = record.duration_ms or 0
+
+    def progress(rows):
+        record.rows = (record.rows or 0) + rows
+        record.batches = (record.batches or 0) + 1
+        record.updated_at = datetime.utcnow()
+        record.duration_ms = elapsed_before + int((time.perf_counter() - started) * 1000)
+
+    if migration.kind == 'schema':
+        migration.apply()
+        progress(0)
+        record.finished_at = record.updated_at
+        db.session.commit()
+        return
+
+    checkpoint = json.loads(record.checkpoint) if record.checkpoint else None
+    while True:
+        checkpoint, rows = migration.step(checkpoint, batch_size)
+        progress(rows)
+        record.checkpoint = json.dumps(checkpoint) if checkpoint is not None else None
+        if checkpoint is None:
+            record.finished_at = record.updated_at
+        # The batch and the checkpoint after it commit together, so a crash never redoes or loses one
+        db.session.commit()
+        if checkpoint is None:
+            return
+        if record.batches % 100 == 0:
+            logger.info('Migration %s: %d rows in %d batches', migration.id, record.rows, record.batches)
+        time.sleep(pause)
+
+
+def run_migrations(kinds=('schema', 'data'), only=None, batch_size=1000, pause=0.02):
+    """
+    Apply pending migrations in order and return the ids applied.
+
+    Data migrations run in batches of ``batch_size`` rows, each in its own
+    short transaction followed by a ``pause`` (seconds), so door events
+    keep getting the write lock while a large table is converted.
+    Migrations another live process is running are left to it.
+    """
+    SchemaMigration.__table__.create(bind=db.engine, checkfirst=True)
+    records = {record.id: record for record in SchemaMigration.query.all()}
+    # Every migration is registered on sight, including those this call does not run
+    for migration in MIGRATIONS:
+        if migration.id not in records and (migration.skip is not None or migration.start is not None):
+            records[migration.id] = _register(migration, datetime.utcnow())
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.kind not in kinds or (only and migration.id not in only):
+            continue
+        record = records.get(migration.id)
+        if record is not None and record.finished_at is not None:
+            continue
+
+        record = _claim(migration, record, datetime.utcnow())
+        if record is None:
+            logger.info('Migration %s is being applied by another process', migration.id)
+            continue
+        try:
+            _run_one(migration, record, batch_size, pause)
+        except Exception:
+            db.session.rollback()
+            logger.exception('Migration %s failed', migration.id)
+            raise
+        logger.info('Applied migration %s in %d ms (%d rows)', migration.id, record.duration_ms, record.rows)
+        applied.append(migration.id)
+    return applied
+
+
+def migration_status():
+    """State, rows and timing of every known migration, in order."""
+    SchemaMigration.__table__.create(bind=db.engine, checkfirst=True)
+    records = {record.id: record for record in SchemaMigration.query.all()}
+    status = []
+    for migration in MIGRATIONS:
+        record = records.get(migration.id)
+        if record is None or (record.finished_at is None and record.updated_at == NOT_STARTED):
+            state = 'pending'
+        elif record.finished_at is None:
+            state = 'running'
+        else:
+            state = 'skipped' if record.skipped else 'done'
+        status.append({
+            'id': migration.id,
+            'kind': migration.kind,
+            'description': migration.description,
+            'state': state,
+            'rows': record.rows if record else 0,
+            'batches': record.batches if record else 0,
+            'duration_ms': record.duration_ms if record else 0,
+            'finished_at': record.finished_at.isoformat() if record and record.finished_at else None,
+        })
+    return status
+
+
+def configure_migrations(app):
+    """Apply schema migrations, and data migrations unless MIGRATE_DATA_ON_STARTUP is off."""
+    kinds = ('schema', 'data') if app.config.get('MIGRATE_DATA_ON_STARTUP', True) else ('schema',)
+    run_migrations(
+        kinds=kinds,
+        batch_size=app.config.get('MIGRATION_BATCH_SIZE', 1000),
+        pause=app.config.get('MIGRATION_PAUSE_MS', 20) / 1000.0,
+    )
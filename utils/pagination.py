@@ -0,0 +1,50 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(*values):
+    """Opaque, URL-safe cursor holding the sort key of the last row returned."""
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """
+    Inverse of encode_cursor(); ``types`` converts each value (datetime is
+    parsed from ISO format). Raises ValueError for a malformed cursor.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError('Invalid cursor')
+    try:
+        return [datetime.fromisoformat(value) if kind is datetime else kind(value)
+                for kind, value in zip(types, values)]
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def after(columns, values, descending=True):
+    """
+    WHERE clause selecting rows that sort after ``values`` on ``columns``.
+
+    Spelled out as ``c1 <= v1 AND (c1 < v1 OR c2 < v2 ...)`` instead of a
+    row-value comparison so the leading column is a plain range on the
+    index.
+    """
+    def beyond(column, value):
+        return column < value if descending else column > value
+
+    def reached(column, value):
+        return column <= value if descending else column >= value
+
+    clauses = []
+    for position, (column, value) in enumerate(zip(columns, values)):
+        equal = [prefix == prefix_value for prefix, prefix_value in zip(columns[:position], values[:position])]
+        clauses.append(and_(*equal, beyond(column, value)))
+    return and_(reached(columns[0], values[0]), or_(*clauses))
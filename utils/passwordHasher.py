@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import hmac
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+SALT_BYTES = 16
+DIGEST_BYTES = 32
+
+DEFAULT_PARAMS = {
+    'scrypt': {'n': 2 ** 14, 'r': 8, 'p': 1},
+    'pbkdf2_sha256': {'i': 600000},
+}
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _derive(algorithm, params, password, salt):
+    if algorithm == 'scrypt':
+        n, r, p = params['n'], params['r'], params['p']
+        # OpenSSL's default limit (32 MB) is below what larger n * r need
+        maxmem = max(32 * 1024 * 1024, 2 * 128 * n * r * p)
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=DIGEST_BYTES)
+    if algorithm == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password, salt, params['i'], dklen=DIGEST_BYTES)
+    raise ValueError(f'Unknown password hash algorithm: {algorithm}')
+
+
+def encode_params(params):
+    return ','.join(f'{name}={value}' for name, value in sorted(params.items()))
+
+
+def decode_params(text):
+    return {name: int(value) for name, value in (item.split('=', 1) for item in text.split(','))}
+
+
+def is_legacy(encoded):
+    """Unsalted SHA-256 hex digest written before the KDF hashes existed"""
+    return '$' not in encoded and len(encoded) == 64
+
+
+def hash_password(password, algorithm='scrypt', params=None):
+    """Salted KDF hash, stored as <algorithm>$<params>$<salt>$<digest> (params like n=16384,p=1,r=8)"""
+    params = params or DEFAULT_PARAMS[algorithm]
+    salt = os.urandom(SALT_BYTES)
+    digest = _derive(algorithm, params, password.encode(), salt)
+    return '$'.join([algorithm, encode_params(params), _b64(salt), _b64(digest)])
+
+
+def verify_password(password, encoded):
+    """Check ``password`` against a hash in any supported format, in constant time."""
+    if is_legacy(encoded):
+        return hmac.compare_digest(encoded, hashlib.sha256(password.encode()).hexdigest())
+    try:
+        algorithm, params, salt, digest = encoded.split('$')
+        expected = _unb64(digest)
+        actual = _derive(algorithm, decode_params(params), password.encode(), _unb64(salt))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+class PasswordHasher:
+    """
+    Password hashing with the configured KDF, run on a small worker pool.
+
+    The pool caps how many KDF computations run at once, so a burst of
+    logins cannot take every CPU from door traffic. At most ``max_pending``
+    more calls may wait for a worker; beyond that, or after ``timeout``
+    seconds of waiting for a slot, queue.Full is raised (the caller answers
+    503). hashlib releases the GIL while deriving, so workers really run in
+    parallel.
+    """
+
+    def __init__(self, algorithm='scrypt', params=None, workers=None, max_pending=64, timeout=5):
+        self._lock = threading.Lock()
+        self._pool = None
+        self.configure(algorithm, params, workers, max_pending, timeout)
+
+    def configure(self, algorithm='scrypt', params=None, workers=None, max_pending=64, timeout=5):
+        if algorithm not in DEFAULT_PARAMS:
+            raise ValueError(f'Unknown password hash algorithm: {algorithm}')
+        self.stop()
+        self.algorithm = algorithm
+        self.params = dict(DEFAULT_PARAMS[algorithm], **(params or {}))
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, int(max_pending)))
+        self._dummy = None
+
+    def stop(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _submit(self, function, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise queue.Full('password hashing pool saturated')
+        try:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                future = self._pool.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _run(self, function, *args):
+        return self._submit(function, *args).result()
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.algorithm, self.params)
+
+    def hash_many(self, passwords):
+        """
+        Hash several passwords on all workers; same order as ``passwords``.
+
+        At most ``workers`` of them are queued at a time, so a large batch
+        never takes the slots logins wait in and they keep getting a worker
+        in turn instead of queue.Full.
+        """
+        passwords = list(passwords)
+        hashes = [None] * len(passwords)
+        pending = {}  # future -> index in passwords
+        for index, password in enumerate(passwords):
+            if len(pending) >= self.workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    hashes[pending.pop(future)] = future.result()
+            pending[self._submit(hash_password, password, self.algorithm, self.params)] = index
+        for future, index in pending.items():
+            hashes[index] = future.result()
+        return hashes
+
+    def verify(self, password, encoded):
+        """True when ``password`` matches ``encoded``; pass None for an unknown user."""
+        if encoded is None:
+            # Same work as a wrong password, so response times don't reveal which emails exist
+            if self._dummy is None:
+                self._dummy = hash_password(os.urandom(8).hex(), self.algorithm, self.params)
+            self._run(verify_password, password, self._dummy)
+            return False
+        return self._run(verify_password, password, encoded)
+
+    def needs_rehash(self, encoded):
+        """True for legacy hashes and hashes made with another algorithm or cost."""
+        if is_legacy(encoded):
+            return True
+        algorithm, params = encoded.split('$', 2)[:2]
+        return algorithm != self.algorithm or params != encode_params(self.params)
+
+
+password_hasher = PasswordHasher()
+
+
+def configure_password_hasher(app):
+    algorithm = app.config.get('PASSWORD_HASHER', 'scrypt')
+    if algorithm == 'scrypt':
+        params = {'n': app.config.get('PASSWORD_SCRYPT_N', 2 ** 14),
+                  'r': app.config.get('PASSWORD_SCRYPT_R', 8),
+                  'p': app.config.get('PASSWORD_SCRYPT_P', 1)}
+    else:
+        params = {'i': app.config.get('PASSWORD_PBKDF2_ITERATIONS', 600000)}
+    password_hasher.configure(
+        algorithm=algorithm,
+        params=params,
+        workers=app.config.get('PASSWORD_HASH_WORKERS'),
+        max_pending=app.config.get('PASSWORD_HASH_QUEUE', 64),
+        timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 5),
+    )
@@ -1,29 +1,176 @@
 import base64
-import secrets
 import hashlib
 import hmac
+import threading
 import time
+from datetime import datetime
 
-from models import User
+from sqlalchemy import delete, insert
 
-SECRET_KEY = "chuj".encode("utf-8")
+from models import db, User, QRRevocation
 
+# Signs the old "<user_id>|<signature>" tokens printed before expiry and
+# revocation were embedded in the token itself.
+LEGACY_SECRET_KEY = "chuj".encode("utf-8")
 
-def generate_secure_token(user_id, length=12):
-    """Generate a short, URL-safe HMAC token for a user."""
-    message = str(user_id).encode('utf-8')
-    signature = hmac.new(SECRET_KEY, message, hashlib.sha256).digest()
+_settings = {
+    'secret_key': None,
+    'signature_length': 16,
+    'accept_legacy': True,
+}
 
-    # Zamiana na URL-safe base64 i skrócenie
-    short_sig = base64.urlsafe_b64encode(signature)[:length].decode('utf-8')
-    return f"{user_id}|{short_sig}"
+
+class RevocationList:
+    """
+    In-process copy of the qr_revocations table.
+
+    Maps user_id -> lowest token version still accepted, so a scan is
+    checked with one dict lookup. Changes made by this worker apply
+    immediately; changes made by other workers are picked up by a
+    background reload every few seconds.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._versions)
+
+    def is_revoked(self, user_id, version):
+        return version < self._versions.get(user_id, 0)
+
+    def _merge(self, versions):
+        # Versions only ever go up, so a stale reload never undoes a revocation
+        with self._lock:
+            merged = dict(self._versions)
+            for user_id, version in versions.items():
+                merged[user_id] = max(version, merged.get(user_id, 0))
+            self._versions = merged
+
+    def load_from_db(self):
+        rows = db.session.query(QRRevocation.user_id, QRRevocation.min_version).all()
+        self._merge(dict(rows))
+
+    def revoke(self, user_id, min_version):
+        """Reject tokens of ``user_id`` older than ``min_version``; the caller commits."""
+        db.session.merge(QRRevocation(user_id=user_id, min_version=min_version))
+        self._merge({user_id: min_version})
+
+    def revoke_many(self, versions):
+        """revoke() for a {user_id: min_version} dict with two statements; the caller commits."""
+        if not versions:
+            return
+        user_ids = list(versions)
+        db.session.execute(delete(QRRevocation).where(QRRevocation.user_id.in_(user_ids)))
+        now = datetime.utcnow()
+        db.session.execute(insert(QRRevocation), [
+            {'user_id': user_id, 'min_version': version, 'updated_at': now} for user_id, version in versions.items()
+        ])
+        self._merge(versions)
+
+    def start_refresh(self, app, interval):
+        if interval <= 0 or self._thread is not None:
+            return
+
+        def refresh():
+            while True:
+                time.sleep(interval)
+                with app.app_context():
+                    try:
+                        self.load_from_db()
+                    except Exception:
+                        app.logger.exception('Reloading QR revocations failed')
+                    finally:
+                        db.session.remove()
+
+        self._thread = threading.Thread(target=refresh, name='qr-revocations', daemon=True)
+        self._thread.start()
+
+
+revocations = RevocationList()
+
+
+def _sign(message, length=None):
+    signature = hmac.digest(_settings['secret_key'], message.encode('utf-8'), 'sha256')
+    return base64.urlsafe_b64encode(signature)[:length or _settings['signature_length']].decode('utf-8')
+
+
+def _expires_at(user):
+    return int(user.expire_time.timestamp()) if user.expire_time else 0
+
+
+def generate_secure_token(user, version=None):
+    """
+    Generate a short, URL-safe token "<user_id>.<expires>.<version>.<signature>".
+
+    ``expires`` is the account expiry as a unix timestamp (0: never) and
+    ``version`` the user's token_version (unless given), so verify_token()
+    can decide from the token alone.
+    """
+    version = (user.token_version or 0) if version is None else version
+    message = f"{user.id}.{_expires_at(user)}.{version}"
+    return f"{message}.{_sign(message)}"
+
+
+def first_token_versions(user_ids):
+    """
+    token_version new users with these ids start at, for the ids that need one.
+
+    SQLite tables created before users had AUTOINCREMENT hand out the id
+    of a deleted user again. That user's tokens stay revoked below the
+    version recorded at deletion, so the new user starts there.
+    """
+    if not user_ids:
+        return {}
+    return dict(
+        db.session.query(QRRevocation.user_id, QRRevocation.min_version)
+        .filter(QRRevocation.user_id.in_(list(user_ids))).all()
+    )
+
+
+def rotate_qr_token(user):
+    """Issue a new token for ``user`` and revoke every token issued before it."""
+    user.token_version = (user.token_version or 0) + 1
+    revocations.revoke(user.id, user.token_version)
+    user.qr_token = generate_secure_token(user)
+    return user.qr_token
 
 
 def verify_token(token):
     """
     Verify the token and extract user_id if valid.
     Returns user_id if valid, else None.
+
+    Only the signature, the embedded expiry and the in-process revocation
+    list are checked; the database is not queried.
     """
+    if not isinstance(token, str):
+        return None
+    parts = token.split('.')
+    if len(parts) != 4:
+        if _settings['accept_legacy'] and '|' in token:
+            return verify_legacy_token(token)
+        return None
+
+    message, received_signature = token.rpartition('.')[::2]
+    if not hmac.compare_digest(received_signature, _sign(message)):
+        return None
+
+    try:
+        user_id, expires, version = (int(part) for part in parts[:3])
+    except ValueError:
+        return None
+    if expires and time.time() > expires:
+        return None
+    if revocations.is_revoked(user_id, version):
+        return None
+    return user_id
+
+
+def verify_legacy_token(token):
+    """Verify an old "<user_id>|<signature>" token, which needs the user row for its expiry."""
     try:
         parts = token.split('|')
         if len(parts) != 2:
@@ -32,14 +179,16 @@ def verify_token(token):
         user_id_str, received_signature = parts
         user_id = int(user_id_str)
 
-        user = User.query.get(user_id)
+        if revocations.is_revoked(user_id, 0):
+            return None
+        user = db.session.get(User, user_id)
         if not user or user.is_expired():
             return None
 
         # Recreate the message and signature
         message = str(user_id).encode('utf-8')
         expected_signature = base64.urlsafe_b64encode(
-            hmac.new(SECRET_KEY, message, hashlib.sha256).digest()
+            hmac.new(LEGACY_SECRET_KEY, message, hashlib.sha256).digest()
         )[:len(received_signature)].decode('utf-8')
 
         # Constant-time comparison
@@ -52,3 +201,10 @@ def verify_token(token):
         return None
 
 
+def configure_qr(app):
+    """Read the signing settings and load the revocation list."""
+    _settings['secret_key'] = app.config['QR_SECRET_KEY'].encode('utf-8')
+    _settings['signature_length'] = app.config.get('QR_SIGNATURE_LENGTH', 16)
+    _settings['accept_legacy'] = app.config.get('QR_ACCEPT_LEGACY', True)
+    revocations.load_from_db()
+    revocations.start_refresh(app, app.config.get('QR_REVOCATION_REFRESH', 30))
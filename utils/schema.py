@@ -0,0 +1,24 @@
+from sqlalchemy import inspect, text
+
+from models import db
+
+
+def add_missing_columns(table, columns):
+    """
+    ALTER TABLE ``table`` to add any of ``columns`` ({name: type}) it lacks.
+
+    db.create_all() only creates missing tables, so columns added to an
+    existing model have to be added to old databases by hand.
+    """
+    existing = {column['name'] for column in inspect(db.engine).get_columns(table)}
+    with db.engine.begin() as conn:
+        for name, column_type in columns.items():
+            if name not in existing:
+                ddl = column_type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+
+
+def create_missing_indexes(model):
+    """Create the indexes declared on ``model`` that an existing table does not have yet."""
+    for index in model.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)